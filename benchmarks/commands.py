@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Compare the old linear command matching with CommandRouter.
+
+Run from the repository root:
+
+    python -m benchmarks.commands
+
+"""
+
+from irc.router import CommandRouter
+
+import re
+import time
+
+
+def main() -> None:
+    commands = {
+        fr'\.command{i} +(\w+)$': i
+        for i in range(500)
+    }
+    router = CommandRouter(commands)
+    lines = {
+        'chat': ["Hello everyone, how is it going?"] * 10000,
+        'command': [f".command{i % 500} argument" for i in range(10000)],
+    }
+
+    def linear(text):
+        return [
+            (match, command)
+            for command_re, command in commands.items()
+            for match in [re.match(command_re, text)]
+            if match
+        ]
+
+    def routed(text):
+        return list(router.match(text))
+
+    for kind, texts in lines.items():
+        for impl in (linear, routed):
+            start = time.perf_counter()
+            for text in texts:
+                impl(text)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{impl.__name__:>8}, {kind:>7} lines:"
+                f" {len(texts) / elapsed:10.0f} lines/s"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Compare the line framing throughput of the old and the new IRCClient.recv.
+
+Run from the repository root:
+
+    python -m benchmarks.framing
+
+"""
+
+from irc.framing import LineFramer
+
+import time
+
+from typing import Iterator, List
+
+
+def names_burst(count: int) -> bytes:
+    nicks = " ".join(f"user{i}" for i in range(40))
+    return b"".join(
+        f":irc.example.com 353 SoupBot = #channel{i % 50} :{nicks}\r\n"
+        .encode()
+        for i in range(count)
+    )
+
+
+def chunks(data: bytes, size: int) -> Iterator[bytes]:
+    for pos in range(0, len(data), size):
+        yield data[pos:pos+size]
+
+
+def legacy(data: bytes) -> List[str]:
+    """The framing previously done inline by IRCClient.recv."""
+    lines = []
+    buffer = bytearray()
+    reads = chunks(data, 512)
+    separator = b"\r\n"
+    while True:
+        separator_pos = buffer.find(separator)
+        while separator_pos == -1:
+            chunk = next(reads, None)
+            if chunk is None:
+                return lines
+            buffer.extend(chunk)
+            separator_pos = buffer.find(separator)
+        lines.append(buffer[:separator_pos].decode('utf-8'))
+        buffer = buffer[separator_pos+len(separator):]
+
+
+def framer(data: bytes) -> List[str]:
+    lines = []
+    line_framer = LineFramer()
+    for chunk in chunks(data, 65536):
+        lines.extend(line_framer.feed(chunk))
+    return lines
+
+
+def main() -> None:
+    for count in (1000, 10000, 50000):
+        data = names_burst(count)
+        assert legacy(data) == framer(data)
+        for impl in (legacy, framer):
+            start = time.perf_counter()
+            impl(data)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{impl.__name__:>8}: {count:6d} lines,"
+                f" {count / elapsed:12.0f} lines/s"
+            )
+
+
+if __name__ == '__main__':
+    main()
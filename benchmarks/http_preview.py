@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Compare the preview latency and memory use of the old (full download
+and BeautifulSoup) and the new (streaming) title extraction, using the
+large pages of the local HTTP mock.
+
+Run from the repository root:
+
+    python -m benchmarks.http_preview
+
+"""
+
+from irc.plugins.http_preview import fetch_title
+from tests.http_mock import http_mock_server
+
+from bs4 import BeautifulSoup
+import asyncio
+import httpx
+import logging
+import multiprocessing
+import time
+import tracemalloc
+
+from typing import Awaitable, Callable, Optional
+
+
+PORT = 8081
+RUNS = 10
+PAGES = ["/simple-webpage", "/large-webpage", "/large-file"]
+
+
+async def legacy_fetch_title(
+        client: httpx.AsyncClient,
+        url: str,
+) -> Optional[str]:
+    response = await client.get(url)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    if soup.title is None:
+        return None
+    return " ".join(soup.title.get_text().split())
+
+
+async def measure(
+        name: str,
+        fetch: Callable[[httpx.AsyncClient, str], Awaitable[Optional[str]]],
+        page: str,
+) -> None:
+    url = f"http://127.0.0.1:{PORT}{page}"
+    async with httpx.AsyncClient() as client:
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            title = await fetch(client, url)
+        latency = (time.perf_counter() - start) / RUNS
+
+        tracemalloc.start()
+        await fetch(client, url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{name:>9} {page:>16}: {latency * 1000:8.1f}ms,"
+          f" peak {peak / 1024:8.0f}KiB, title: {title!r}")
+
+
+def serve() -> None:
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    http_mock_server().run(host="127.0.0.1", port=PORT, threaded=True)
+
+
+async def wait_for_server() -> None:
+    async with httpx.AsyncClient() as client:
+        for _ in range(50):
+            try:
+                await client.get(f"http://127.0.0.1:{PORT}/simple-webpage")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+
+
+async def main() -> None:
+    await wait_for_server()
+    for page in PAGES:
+        await measure("legacy", legacy_fetch_title, page)
+        await measure("streaming", fetch_title, page)
+
+
+if __name__ == '__main__':
+    server = multiprocessing.Process(target=serve, daemon=True)
+    server.start()
+    try:
+        asyncio.run(main())
+    finally:
+        server.terminate()
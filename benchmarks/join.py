@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Compute how long the flood control delays joining the channels on
+startup: one JOIN per channel (the old behavior) and the JOINs batched
+into 512-byte lines.
+
+The delay is computed from the token bucket parameters instead of
+waited for, as it's in the order of minutes with the defaults.
+
+Run from the repository root:
+
+    python -m benchmarks.join
+
+"""
+
+from irc.message import IRCMessage, batch_targets
+
+
+# The IRCClient defaults.
+FLOOD_BURST = 1024
+FLOOD_RATE = 128
+FLOOD_PENALTY = 64
+
+
+def join_time(lines) -> float:
+    """Seconds until the last line leaves a full token bucket."""
+    cost = sum(
+        len(f"{line}\r\n".encode()) + FLOOD_PENALTY
+        for line in lines
+    )
+    return max(0, cost - FLOOD_BURST) / FLOOD_RATE
+
+
+def main() -> None:
+    for count in (10, 100, 500):
+        channels = [f"#example-channel-{i}" for i in range(count)]
+        for name, lines in (
+                ('sequential', [
+                    IRCMessage('JOIN', channel) for channel in channels
+                ]),
+                ('batched', [
+                    IRCMessage('JOIN', batch)
+                    for batch in batch_targets(channels, 505)
+                ]),
+        ):
+            print(
+                f"{name:>10} {count:>3} channels:"
+                f" {len(lines):>3} lines, {join_time(lines):6.1f}s"
+            )
+
+
+if __name__ == '__main__':
+    main()
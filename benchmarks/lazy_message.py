@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Measure the time and memory of parsing a replayed IRC log.
+
+Run from the repository root:
+
+    python -m benchmarks.lazy_message [raw_irc_log]
+
+The log should contain the raw protocol lines, one per line.  Without
+it, a synthetic busy-channel log is generated.  Each line is parsed
+and kept alive (like in the plugin queues) and only the fields
+typically used by the plugins are accessed: the command for every
+message and the body and the sender of the PRIVMSGs.
+
+"""
+
+from irc.message import IRCMessage
+from tests.legacy_message import legacy_parse
+
+import sys
+import time
+import tracemalloc
+
+from typing import Callable, List
+
+
+def synthetic_log(count: int) -> List[str]:
+    templates = [
+        ":nick{i}!~user{i}@host{i}.example.com PRIVMSG #channel :message {i}",
+        ":nick{i}!~user{i}@host{i}.example.com JOIN #channel",
+        ":nick{i}!~user{i}@host{i}.example.com PART #channel :bye",
+        ":nick{i}!~user{i}@host{i}.example.com QUIT :Quit: leaving",
+        ":irc.example.com 353 SoupBot = #channel :nick{i} +voiced{i} @op{i}",
+        "PING :irc.example.com",
+    ]
+    return [
+        templates[i % len(templates)].format(i=i)
+        for i in range(count)
+    ]
+
+
+def replay(lines: List[str], parse: Callable[[str], IRCMessage]) -> list:
+    messages = []
+    for line in lines:
+        msg = parse(line)
+        if msg.command == 'PRIVMSG':
+            msg.body
+            msg.sender
+        messages.append(msg)
+    return messages
+
+
+def eager_parse(line: str) -> IRCMessage:
+    msg = IRCMessage.parse(line)
+    msg.args, msg.trailing, msg.sender, msg.tags
+    return msg
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as log:
+            lines = log.read().splitlines()
+    else:
+        lines = synthetic_log(100000)
+
+    for name, parse in (
+            ('legacy', legacy_parse),
+            ('eager', eager_parse),
+            ('lazy', IRCMessage.parse),
+    ):
+        start = time.perf_counter()
+        replay(lines, parse)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        messages = replay(lines, parse)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del messages
+
+        print(
+            f"{name:>8}: {len(lines) / elapsed:10.0f} lines/s,"
+            f" {memory / len(lines):6.0f} B/message"
+        )
+
+
+if __name__ == '__main__':
+    main()
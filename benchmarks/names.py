@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Measure the cold start name resolution time against a simulated
+server with some latency: one channel at a time (the old behavior,
+as NameTrack waited for each NAMES reply) and all at once, batched.
+
+Run from the repository root:
+
+    python -m benchmarks.names
+
+"""
+
+from irc.message import IRCMessage
+from irc.plugins.name_track import NamesRequests
+
+import asyncio
+import time
+
+
+LATENCY = 0.02
+NICKS = [f"user{i}" for i in range(50)]
+
+
+def simulated_server() -> NamesRequests:
+    loop = asyncio.get_event_loop()
+
+    def reply(channels: str) -> None:
+        for channel in channels.split(","):
+            requests.names(channel, NICKS)
+            requests.end(channel)
+
+    def send(msg: IRCMessage) -> None:
+        loop.call_later(LATENCY, reply, msg.args[0])
+
+    requests = NamesRequests(send)
+    return requests
+
+
+async def sequential(channels) -> None:
+    requests = simulated_server()
+    requests.batch_delay = 0
+    for channel in channels:
+        await requests.request(channel)
+
+
+async def batched(channels) -> None:
+    requests = simulated_server()
+    await asyncio.gather(*map(requests.request, channels))
+
+
+async def main() -> None:
+    for count in (10, 100, 500):
+        channels = [f"#channel{i}" for i in range(count)]
+        for name, resolve in (
+                ('sequential', sequential),
+                ('batched', batched),
+        ):
+            start = time.perf_counter()
+            await resolve(channels)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>10} {count:>3} channels: {elapsed:.3f}s")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
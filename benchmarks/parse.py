@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Compare the throughput of the old and the new IRCMessage.parse.
+
+Run from the repository root:
+
+    python -m benchmarks.parse
+
+"""
+
+from irc.message import IRCMessage
+from tests.legacy_message import legacy_parse
+
+import time
+
+
+LINES = [
+    "PING :irc.example.com",
+    ":irc.example.com 353 SoupBot = #channel :@op +voice user1 user2 user3",
+    ":nick!~user@some.host.example.com PRIVMSG #channel :Hello, world!",
+    ":nick!~user@some.host.example.com JOIN #channel",
+    ":nick!~user@some.host.example.com QUIT :Quit: leaving",
+    "@time=2020-01-01T00:00:00.000Z;account=nick"
+    " :nick!~user@some.host.example.com PRIVMSG #channel :tagged",
+]
+
+
+def main() -> None:
+    count = 100000
+    lines = [LINES[i % len(LINES)] for i in range(count)]
+    for name, parse in (
+            ('legacy', legacy_parse),
+            ('parse', IRCMessage.parse),
+    ):
+        start = time.perf_counter()
+        for line in lines:
+            try:
+                parse(line)
+            except Exception:
+                # The legacy parser doesn't support the message tags.
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8}: {count / elapsed:10.0f} lines/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Measure preparing the outgoing lines for sending: the old way (the
+per-character Unicode category checks and a separate serialization
+for the length check) and with encode_line().
+
+Run from the repository root:
+
+    python -m benchmarks.sanitize
+
+"""
+
+from irc.message import IRCMessage, encode_line
+
+import time
+import unicodedata
+
+from typing import Callable, List, Union
+
+
+COUNT = 20000
+
+
+def old_send_data(msg: Union[IRCMessage, str]) -> bytes:
+    """What IRCClient._send used to do."""
+    def isprintable(string: str) -> bool:
+        return all(not unicodedata.category(c) == 'Cc' for c in string)
+
+    if isinstance(msg, str):
+        msg = IRCMessage.parse(msg)
+    if msg.trailing is not None:
+        if not isprintable(msg.trailing):
+            raise ValueError()
+    for arg in msg.args:
+        if not isprintable(arg):
+            raise ValueError()
+    if len(str(msg).encode()) > 512:
+        raise ValueError()
+    return f"{msg}\r\n".encode()
+
+
+def new_send_data(msg: Union[IRCMessage, str]) -> bytes:
+    return encode_line(str(msg))
+
+
+def measure(
+        send_data: Callable[[Union[IRCMessage, str]], bytes],
+        messages: List[Union[IRCMessage, str]],
+) -> float:
+    start = time.perf_counter()
+    for msg in messages:
+        send_data(msg)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def main() -> None:
+    for length in (20, 100, 300):
+        body = ("zażółć gęślą jaźń " * 30)[:length]
+        for kind, messages in (
+                ('IRCMessage', [
+                    IRCMessage('PRIVMSG', '#channel', body=body)
+                    for _ in range(COUNT)
+                ]),
+                ('str', [f"PRIVMSG #channel :{body}"] * COUNT),
+        ):
+            assert old_send_data(messages[0]) == new_send_data(messages[0])
+            old = measure(old_send_data, messages)
+            new = measure(new_send_data, messages)
+            print(
+                f"{kind:>10} {length:>3} chars:"
+                f" old {old * 1e6:6.1f}µs, new {new * 1e6:6.1f}µs"
+            )
+
+
+if __name__ == '__main__':
+    main()
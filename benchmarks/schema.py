@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Measure the latency of the score and offline message queries on
+a million stored rows, before and after the index migrations.
+
+Run from the repository root:
+
+    python -m benchmarks.schema
+
+"""
+
+from irc.plugins.offline_msg import OfflineMessages
+from irc.plugins.user_score import UserScore
+
+from datetime import datetime
+import os
+import sqlite3
+import tempfile
+import time
+
+from typing import Callable
+
+
+ROWS = 1000000
+CHANNELS = 100
+RUNS = 20
+
+QUERIES = {
+    '.scores': (
+        '''
+        SELECT nick, score FROM score
+        WHERE channel=?
+        ORDER BY score DESC
+        LIMIT ?
+        ''',
+        ("#channel7", 10),
+    ),
+    'dump count': (
+        'SELECT COUNT(*) FROM offline_msg WHERE channel=? AND recipient=?',
+        ("#channel7", "user7"),
+    ),
+    'dump select': (
+        '''
+        SELECT time, sender, body FROM offline_msg
+        WHERE channel=? AND recipient=?
+        ORDER BY rowid
+        ''',
+        ("#channel7", "user7"),
+    ),
+}
+
+
+def populate(connection: sqlite3.Connection) -> None:
+    connection.execute(UserScore.schema[0])
+    connection.execute(OfflineMessages.schema[0])
+    connection.executemany(
+        'INSERT INTO score (nick, channel, score) VALUES (?, ?, ?)',
+        (
+            (f"nick{i}", f"#channel{i % CHANNELS}", i * 7919 % 10007)
+            for i in range(ROWS)
+        ),
+    )
+    now = datetime.now()
+    connection.executemany(
+        '''
+        INSERT INTO offline_msg (time, sender, recipient, channel, body)
+        VALUES (?, ?, ?, ?, ?)
+        ''',
+        (
+            (now, f"nick{i}", f"user{i % 1000}",
+             f"#channel{i % CHANNELS}", "user7: bacon")
+            for i in range(ROWS)
+        ),
+    )
+    connection.commit()
+
+
+def timed(function: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        function()
+    return (time.perf_counter() - start) / RUNS
+
+
+def report(connection: sqlite3.Connection, label: str) -> None:
+    for name, (sql, parameters) in QUERIES.items():
+        latency = timed(
+            lambda: connection.execute(sql, parameters).fetchall()
+        )
+        print(f"{label:>8} {name:>12}: {latency * 1000:8.3f}ms")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        connection = sqlite3.connect(
+            os.path.join(tmpdir, "bench.db"),
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        populate(connection)
+        report(connection, "before")
+        for schema in (UserScore.schema, OfflineMessages.schema):
+            for sql in schema[1:]:
+                connection.execute(sql)
+        connection.commit()
+        report(connection, "after")
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
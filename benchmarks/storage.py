@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Measure how long the database work stalls the event loop, with the
+queries run inline (the old behavior) and on the Storage thread.
+
+Run from the repository root:
+
+    python -m benchmarks.storage
+
+"""
+
+from irc.storage import Storage
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from typing import List
+
+
+ROWS = 200000
+UPDATES = 500
+TICK = 0.001
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS score
+(
+    nick STRING COLLATE NOCASE,
+    channel STRING,
+    score INTEGER,
+    UNIQUE(nick, channel)
+)
+'''
+
+UPSERT = '''
+INSERT INTO score
+(nick, channel, score)
+VALUES (?, ?, ?)
+ON CONFLICT(nick, channel) DO
+UPDATE SET score = score + ?
+'''
+
+LEADERBOARD = '''
+SELECT nick, score FROM score
+WHERE channel = ?
+ORDER BY score DESC, nick
+'''
+
+
+def populate(path: str) -> None:
+    connection = sqlite3.connect(path)
+    connection.execute(SCHEMA)
+    connection.executemany(
+        'INSERT INTO score (nick, channel, score) VALUES (?, ?, ?)',
+        ((f"nick{i}", "#channel", i % 1000) for i in range(ROWS)),
+    )
+    connection.commit()
+    connection.close()
+
+
+async def heartbeat(stalls: List[float]) -> None:
+    """Record how late each tick of a periodic task is."""
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        stalls.append(loop.time() - start - TICK)
+
+
+async def measure(workload) -> List[float]:
+    stalls: List[float] = []
+    ticker = asyncio.ensure_future(heartbeat(stalls))
+    await asyncio.sleep(TICK * 10)
+    await workload()
+    ticker.cancel()
+    return stalls
+
+
+def report(name: str, elapsed: float, stalls: List[float]) -> None:
+    print(f"{name:>8}: {elapsed:.3f}s total,"
+          f" max stall {max(stalls) * 1000:.1f}ms,"
+          f" {sum(s > 0.01 for s in stalls)} stalls over 10ms")
+
+
+async def main() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "scores.db")
+        populate(path)
+
+        connection = sqlite3.connect(path)
+
+        async def inline() -> None:
+            for i in range(UPDATES):
+                connection.execute(UPSERT, (f"nick{i}", "#channel", 1, 1))
+                connection.commit()
+                if i % 100 == 0:
+                    connection.execute(LEADERBOARD, ("#channel",)).fetchall()
+                await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        stalls = await measure(inline)
+        report("inline", time.perf_counter() - start, stalls)
+        connection.close()
+
+        storage = Storage(path, commit_delay=0.1)
+
+        async def threaded() -> None:
+            for i in range(UPDATES):
+                storage.execute(UPSERT, (f"nick{i}", "#channel", 1, 1))
+                storage.commit()
+                if i % 100 == 0:
+                    await storage.execute(LEADERBOARD, ("#channel",))
+                await asyncio.sleep(0)
+            await storage.flush()
+
+        start = time.perf_counter()
+        stalls = await measure(threaded)
+        report("thread", time.perf_counter() - start, stalls)
+        storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Compare the per-message cost of looking for URLs with URLExtract
+alone (the old behavior) and with the pre-filter in front of it, on
+a replayed chat log.
+
+Run from the repository root:
+
+    python -m benchmarks.url_extract
+
+"""
+
+from irc.plugins.http_preview import may_contain_url
+
+from urlextract import URLExtract
+import random
+import time
+
+from typing import List
+
+
+MESSAGES = 20000
+
+WORDS = (
+    "the a to and of is it that you in for on this have with but not"
+    " what was just so like be are do can if my me no yes ok lol"
+    " bacon++ SoupBot: Ping! I'm :) etc. foo_bar"
+).split()
+
+# The words tripping the pre-filter without being URLs.
+DOTTED = ["e.g.", "i.e.", "3.14", "v2.0", "file.txt", "Mr.Smith"]
+
+LINKS = [
+    "https://example.com/some/article?id=42",
+    "http://127.0.0.1:8080/simple-webpage",
+    "www.example.org",
+    "example.com/path",
+]
+
+
+def chat_log(count: int) -> List[str]:
+    """A chat log where about 1 in 50 messages has a link, and 1 in 20
+    has some other dotted word.
+
+    """
+    rng = random.Random(0)
+    log = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randrange(1, 20))
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words)), rng.choice(DOTTED))
+        if rng.random() < 0.02:
+            words.insert(rng.randrange(len(words)), rng.choice(LINKS))
+        sentence = " ".join(words).capitalize()
+        log.append(sentence + rng.choice((".", "", "?", "!")))
+    return log
+
+
+def main() -> None:
+    start = time.perf_counter()
+    extractor = URLExtract()
+    print(f"URLExtract(): {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    log = chat_log(MESSAGES)
+
+    start = time.perf_counter()
+    legacy = [list(extractor.gen_urls(msg)) for msg in log]
+    elapsed = time.perf_counter() - start
+    print(f"      legacy: {elapsed / MESSAGES * 1e6:6.1f}µs/message")
+
+    start = time.perf_counter()
+    filtered = [
+        list(extractor.gen_urls(msg)) if may_contain_url(msg) else []
+        for msg in log
+    ]
+    elapsed = time.perf_counter() - start
+    print(f"  pre-filter: {elapsed / MESSAGES * 1e6:6.1f}µs/message,"
+          f" {sum(map(may_contain_url, log))} of {MESSAGES} scanned")
+
+    assert filtered == legacy
+
+
+if __name__ == '__main__':
+    main()
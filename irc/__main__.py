@@ -52,7 +52,7 @@ async def run_bot():
         logger.info("Loading the new plugins…")
         await bot.load_plugins(
             conf['plugins'],
-            old_data=bot.unload_plugins()
+            old_data=await bot.unload_plugins()
         )
         logger.info("Restaring the IRC event loop with new plugins…")
         bot_task = asyncio.ensure_future(bot.event_loop())
@@ -69,20 +69,24 @@ async def run_bot():
         f"Use 'kill -SIGUSR1 {os.getpid()}' to reload all plugins."
     )
 
-    await bot.greet()
-    await bot.load_plugins(conf['plugins'])
-    bot_task = asyncio.ensure_future(bot.event_loop())
-    while True:
-        try:
-            await bot_task
-        except asyncio.CancelledError:
-            if reload_task is not None:
-                await reload_task
-                reload_task = None
+    try:
+        await bot.greet()
+        await bot.load_plugins(conf['plugins'])
+        bot_task = asyncio.ensure_future(bot.event_loop())
+        while True:
+            try:
+                await bot_task
+            except asyncio.CancelledError:
+                if reload_task is not None:
+                    await reload_task
+                    reload_task = None
+                else:
+                    raise
             else:
-                raise
-        else:
-            return
+                return
+    finally:
+        await bot.unload_plugins()
+        bot.db.close()
 
 
 def start_event_loop():
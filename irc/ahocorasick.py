@@ -0,0 +1,73 @@
+from collections import deque
+import re
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+_word_re = re.compile(r'\w')
+
+
+class AhoCorasick:
+    """Find all the occurrences of many strings in a single pass."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+
+        for pattern in patterns:
+            if pattern:
+                self._insert(pattern)
+        self._link()
+
+    def _insert(self, pattern: str) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        if pattern not in self._out[state]:
+            self._out[state].append(pattern)
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
+
+    def search(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Yield the start positions and the patterns found in the text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern in out[state]:
+                yield pos + 1 - len(pattern), pattern
+
+    def search_words(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Like search() but only the occurrences delimited by the word
+        boundaries, as with the \\b regex assertion.
+
+        """
+        def is_word(pos: int) -> bool:
+            return 0 <= pos < len(text) and bool(_word_re.match(text[pos]))
+
+        def is_boundary(pos: int) -> bool:
+            return is_word(pos - 1) != is_word(pos)
+
+        for start, pattern in self.search(text):
+            if is_boundary(start) and is_boundary(start + len(pattern)):
+                yield start, pattern
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import time
+
+from typing import Callable, Iterator, MutableMapping, Tuple, TypeVar
+
+
+Key = TypeVar('Key')
+Value = TypeVar('Value')
+
+
+class TTLCache(MutableMapping[Key, Value]):
+    """A mapping forgetting its entries `ttl` seconds after they were
+    set, and its least recently used entries beyond `maxsize`.
+
+    set() can override the TTL of a single entry, for example to
+    remember the failures for a shorter time.
+
+    """
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            ttl: float = 3600,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[Key, Tuple[float, Value]] = OrderedDict()
+
+    def __getitem__(self, key: Key) -> Value:
+        expires, value = self._entries[key]
+        if expires <= self.clock():
+            del self._entries[key]
+            raise KeyError(key)
+        self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Key, value: Value) -> None:
+        self.set(key, value)
+
+    def set(self, key: Key, value: Value, ttl: float = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        self._entries[key] = (self.clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __delitem__(self, key: Key) -> None:
+        del self._entries[key]
+
+    def __iter__(self) -> Iterator[Key]:
+        now = self.clock()
+        return iter([
+            key for key, (expires, _) in self._entries.items()
+            if expires > now
+        ])
+
+    def __len__(self) -> int:
+        self.expire()
+        return len(self._entries)
+
+    def expire(self) -> None:
+        """Forget all the expired entries."""
+        now = self.clock()
+        for key in [
+                key for key, (expires, _) in self._entries.items()
+                if expires <= now
+        ]:
+            del self._entries[key]
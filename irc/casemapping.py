@@ -0,0 +1,52 @@
+import string
+
+from typing import Callable, Dict, Iterable, Optional
+
+
+_tables = {
+    'ascii': str.maketrans(
+        string.ascii_uppercase,
+        string.ascii_lowercase,
+    ),
+    'rfc1459': str.maketrans(
+        string.ascii_uppercase + "[]\\~",
+        string.ascii_lowercase + "{}|^",
+    ),
+    'strict-rfc1459': str.maketrans(
+        string.ascii_uppercase + "[]\\",
+        string.ascii_lowercase + "{}|",
+    ),
+}
+
+
+def casefolder(casemapping: str = 'rfc1459') -> Callable[[str], str]:
+    """The function folding the nicks and the channel names according to
+    the server's CASEMAPPING.
+
+    The unknown casemappings fall back to rfc1459, the default one.
+    rfc7613 is approximated with the Unicode case folding.
+
+    """
+    if casemapping == 'rfc7613':
+        return str.casefold
+    table = _tables.get(casemapping, _tables['rfc1459'])
+
+    def fold(name: str) -> str:
+        return name.translate(table)
+    return fold
+
+
+def parse_isupport(tokens: Iterable[str]) -> Dict[str, Optional[str]]:
+    """The parameters advertised in the RPL_ISUPPORT (005) tokens.
+
+    The parameters without a value map to None, the negated ones
+    ("-PARAM") are left out.
+
+    """
+    params: Dict[str, Optional[str]] = {}
+    for token in tokens:
+        if token.startswith("-"):
+            continue
+        name, sep, value = token.partition("=")
+        params[name] = value if sep else None
+    return params
@@ -1,40 +1,93 @@
-from .message import IRCMessage, IRCSecurityError
+from .framing import LineFramer
+from .message import IRCMessage, IRCSecurityError, encode_line
+from .outgoing import OutgoingQueue, resolve
+from .ratelimit import TokenBucket
+from .storage import Storage
+from collections import deque
 from types import SimpleNamespace
 import asyncio
 import logging
-import sqlite3
 logger = logging.getLogger(__name__)
 
-from typing import TYPE_CHECKING, Dict, List, Any, Union, Optional  # noqa: F402, E501
+from typing import TYPE_CHECKING, Deque, Dict, Iterable, List, Any, Set, Union, Optional  # noqa: F402, E501
 if TYPE_CHECKING:  # pragma: no cover
     from .plugin import IRCPlugin  # noqa: F401
 
 
+_nick_rejections = frozenset((
+    '432',  # ERR_ERRONEUSNICKNAME
+    '433',  # ERR_NICKNAMEINUSE
+    '436',  # ERR_NICKCOLLISION
+    '437',  # ERR_UNAVAILRESOURCE
+))
+
+
+class RegistrationError(Exception):
+    pass
+
+
+def nick_candidates(
+        nick: str,
+        alternatives: Iterable[str] = (),
+        generated: int = 3,
+) -> List[str]:
+    """The nicks to try when registering: the preferred one, then the
+    configured alternatives, then the preferred one with up to
+    `generated` underscores appended.
+
+    """
+    return [
+        nick,
+        *alternatives,
+        *(nick + "_" * suffix for suffix in range(1, generated + 1)),
+    ]
+
+
 class IRCClient:
     def __init__(
             self,
             socket,
             encoding: str = 'utf-8',
             sqlite_db: str = ':memory:',
-            delay: int = 2,
+            sqlite_commit_delay: float = 1.0,
+            sqlite_pragmas: Dict[str, Any] = None,
+            flood_burst: float = 1024,
+            flood_rate: float = 128,
+            flood_penalty: float = 64,
             queue_size: int = 24,
+            queue_overflow: Dict[str, str] = None,
+            read_size: int = 65536,
             **config: Any,
     ):
         self.socket = socket
         self.encoding = encoding
-        self.delay = delay
+        self.flood_control = TokenBucket(
+            capacity=flood_burst,
+            rate=flood_rate,
+            penalty=flood_penalty,
+        )
         self.queue_size = queue_size
+        self.read_size = read_size
         self.config = config
         self.logger = logger.getChild(type(self).__name__)
-        self.db = sqlite3.connect(
+        if 'delay' in self.config:
+            self.logger.warning(
+                "The delay setting is no longer used,"
+                " see flood_burst and flood_rate instead."
+            )
+        self.db = Storage(
             sqlite_db,
-            detect_types=sqlite3.PARSE_DECLTYPES,
+            commit_delay=sqlite_commit_delay,
+            pragmas=sqlite_pragmas,
         )
         self.nick = self.config['nick']
-        self._buffer = bytearray()
+        self._framer = LineFramer(self.encoding)
+        self._lines: Deque[str] = deque()
         self.plugins: Dict[str, 'IRCPlugin'] = {}
+        self._routes: Dict[str, List['IRCPlugin']] = {}
+        self._catch_all: List['IRCPlugin'] = []
         self.shared_data = SimpleNamespace()
-        self.outgoing_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self.outgoing_queue = OutgoingQueue(self.queue_size, queue_overflow)
 
     def __aiter__(self):
         return self
@@ -47,50 +100,75 @@ class IRCClient:
             raise StopAsyncIteration()
 
     async def recv(self) -> Optional[IRCMessage]:
-        separator = b"\r\n"
-        separator_pos = self._buffer.find(separator)
-        while separator_pos == -1:
-            self._buffer.extend(await self.socket.reader.read(512))
-            if self.at_eof():
+        while not self._lines:
+            data = await self.socket.reader.read(self.read_size)
+            if not data:
                 return None
-            separator_pos = self._buffer.find(separator)
-        msg = self._buffer[:separator_pos].decode(self.encoding)
-        self._buffer = self._buffer[separator_pos+len(separator):]
+            self._lines.extend(self._framer.feed(data))
+        msg = self._lines.popleft()
         self.logger.info(">>> %r", msg)
         return IRCMessage.parse(msg)
 
     def at_eof(self) -> bool:
         return self.socket.reader.at_eof()
 
-    def send(self, msg: Union[IRCMessage, str]) -> None:
-        self.outgoing_queue.put_nowait(msg)
+    def send(self, msg: Union[IRCMessage, str]) -> 'asyncio.Future[bool]':
+        """Enqueue a message without blocking.
+
+        Await the result to wait until the message is sent (True) or
+        discarded by the outgoing queue (False).
+
+        """
+        return self.outgoing_queue.put(msg)
 
     async def _send(
             self,
             msg: Union[IRCMessage, str],
             allow_unsafe: bool = False,  # Mostly for testing.
     ):
+        line = str(msg)
         if self.at_eof():
-            self.logger.info("<!< %r", str(msg))
+            self.logger.info("<!< %r", line)
             raise IOError("The IRC socket is closed.")
-        self.logger.info("<<< %r", str(msg))
-        if not allow_unsafe:
-            if isinstance(msg, IRCMessage):
-                msg.sanitize()
-            elif isinstance(msg, str):
-                IRCMessage.parse(msg).sanitize()
-        self.socket.writer.write(f"{msg}\r\n".encode(self.encoding))
+        self.logger.info("<<< %r", line)
+        data = encode_line(line, self.encoding, sanitize=not allow_unsafe)
+        await self.flood_control.consume(self.flood_control.cost(data))
+        self.socket.writer.write(data)
         await self.socket.writer.drain()
 
     async def greet(self):
+        """Register with the server.
+
+        The nicks are tried in the order given by nick_candidates(),
+        the next one sent as soon as the previous one is rejected.
+        Raises RegistrationError once none is left.
+
+        """
+        alternatives = self.config.get('alt_nicks', [])
+        candidates = deque(nick_candidates(self.config['nick'], alternatives))
+        self.nick = candidates.popleft()
         await self._send(IRCMessage(
             "USER", self.nick, "*", "*", body=self.config['name'],
         ))
         await self._send(IRCMessage('NICK', self.nick))
         async for msg in self:
-            if msg.command == '433':  # ERR_NICKNAMEINUSE
-                self.nick += "_"
-                await self._send(IRCMessage('NICK', self.nick))
+            if msg.command in _nick_rejections:
+                # Ignore the rejections of the nicks tried before.
+                rejected = msg.args[1] if len(msg.args) > 1 else self.nick
+                if rejected.lower() == self.nick.lower():
+                    if msg.command == '432':  # ERR_ERRONEUSNICKNAME
+                        # Appending underscores won't make it valid,
+                        # only the configured nicks may be.
+                        candidates = deque(
+                            nick for nick in candidates
+                            if nick in alternatives
+                        )
+                    if not candidates:
+                        raise RegistrationError(
+                            f"No acceptable nick, the last one: {msg}"
+                        )
+                    self.nick = candidates.popleft()
+                    await self._send(IRCMessage('NICK', self.nick))
             if msg.command == '001':  # RPL_WELCOME
                 break
 
@@ -98,24 +176,29 @@ class IRCClient:
         async def irc_reader():
             try:
                 async for msg in self:
-                    for name, plugin in self.plugins.items():
+                    for plugin in self.route(msg.command):
                         plugin.logger.debug(
                             "Queue size on append: %d", plugin.queue.qsize()
                         )
-                        await plugin.queue.put(msg)
+                        plugin.queue.put_nowait(msg)
                 self.logger.info("Encountered the IRC stream EOF.")
             finally:
                 self.logger.info("IRC reader closing.")
 
         async def irc_writer():
             while True:
-                msg = await self.outgoing_queue.get()
+                msg, outcome = await self.outgoing_queue.get()
                 try:
                     await self._send(msg)
+                    resolve(outcome, True)
                 except IRCSecurityError as e:
                     self.logger.warning("A possible abuse detected: %r", e)
-                else:
-                    await asyncio.sleep(self.delay)
+                finally:
+                    resolve(outcome, False)
+                self.logger.debug(
+                    "Flood control tokens left: %d",
+                    self.flood_control.level,
+                )
 
         async def plugin_runner():
             try:
@@ -137,6 +220,29 @@ class IRCClient:
             plugin_runner_task.cancel()
             irc_writer_task.cancel()
 
+    def route(self, command: str) -> List['IRCPlugin']:
+        """The plugins interested in the messages with this command."""
+        return self._routes.get(command, self._catch_all)
+
+    def _build_routes(self) -> None:
+        plugins = self.plugins.values()
+        self._catch_all = [
+            plugin for plugin in plugins
+            if plugin.irc_commands is None
+        ]
+        commands: Set[str] = set()
+        for plugin in plugins:
+            if plugin.irc_commands is not None:
+                commands.update(plugin.irc_commands)
+        self._routes = {
+            command: [
+                plugin for plugin in plugins
+                if plugin.irc_commands is None
+                or command in plugin.irc_commands
+            ]
+            for command in commands
+        }
+
     async def load_plugins(
             self,
             plugins: List[str],
@@ -179,7 +285,17 @@ class IRCClient:
                     )
                     failed_plugins.append(plugin_class)
 
-        self.plugins.update(load_plugins_helper())
+        for plugin_class, plugin in load_plugins_helper():
+            try:
+                await plugin.setup()
+            except Exception:
+                self.logger.exception(
+                    "%s caused an exception during setup.", plugin_class
+                )
+                failed_plugins.append(plugin_class)
+            else:
+                self.plugins[plugin_class] = plugin
+        self._build_routes()
         self.logger.info(
             "Initialized plugins: %s",
             list(self.plugins.keys()),
@@ -189,9 +305,17 @@ class IRCClient:
         for plugin in self.plugins.values():
             plugin.start()
 
-    def unload_plugins(self) -> Dict[str, Any]:
+    async def unload_plugins(self) -> Dict[str, Any]:
         self.logger.info("Unloading plugins…")
+        for plugin_class, plugin in self.plugins.items():
+            try:
+                await plugin.cleanup()
+            except Exception:
+                self.logger.exception(
+                    "%s caused an exception during cleanup.", plugin_class
+                )
         old_data = vars(self.shared_data)
         self.plugins = {}
+        self._build_routes()
         self.shared_data = SimpleNamespace()
         return old_data
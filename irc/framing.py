@@ -0,0 +1,49 @@
+from typing import List
+
+
+class LineFramer:
+    """Split a byte stream into CRLF-terminated lines.
+
+    The incoming data is appended to a single buffer and consumed by
+    advancing a read offset.  Each byte is scanned for the separator
+    only once and the consumed prefix is dropped only after it grows
+    past `compact_size`, so a burst of lines costs linear time
+    instead of copying the rest of the buffer for every line.
+
+    """
+    separator = b"\r\n"
+
+    def __init__(self, encoding: str = 'utf-8', compact_size: int = 65536):
+        self.encoding = encoding
+        self.compact_size = compact_size
+        self._buffer = bytearray()
+        self._offset = 0
+        self._scan_from = 0
+
+    def __len__(self) -> int:
+        """The number of buffered bytes not yet returned as lines."""
+        return len(self._buffer) - self._offset
+
+    def feed(self, data: bytes) -> List[str]:
+        """Append the data and return all the complete lines, decoded."""
+        buffer = self._buffer
+        buffer += data
+
+        separator = self.separator
+        start = self._offset
+        lines = []
+        with memoryview(buffer) as view:
+            pos = buffer.find(separator, self._scan_from)
+            while pos != -1:
+                lines.append(str(view[start:pos], self.encoding))
+                start = pos + len(separator)
+                pos = buffer.find(separator, start)
+
+        # The last byte may be the first half of a separator.
+        self._scan_from = max(start, len(buffer) - len(separator) + 1)
+        if start == len(buffer) or start > self.compact_size:
+            del buffer[:start]
+            self._scan_from -= start
+            start = 0
+        self._offset = start
+        return lines
@@ -0,0 +1,98 @@
+from collections import Counter, deque
+import asyncio
+import time
+
+from typing import TYPE_CHECKING, Deque, Tuple
+if TYPE_CHECKING:  # pragma: no cover
+    from .message import IRCMessage  # noqa: F401
+
+
+class PluginQueue:
+    """A plugin's incoming message queue that never blocks the producer.
+
+    Up to `maxsize` messages are queued normally.  What happens to the
+    messages arriving when the queue is full depends on `overflow`:
+
+    - drop: the new message is discarded,
+    - spill: the new message is kept in an unbounded buffer as long as
+      the buffered messages take at most `spill_bytes` (as encoded in
+      UTF-8), and discarded otherwise,
+    - shed: the oldest queued message is discarded to make room.
+
+    The outcomes are counted in `stats`, while `lag` and `max_lag`
+    track how long the messages wait before being processed.
+
+    """
+    policies = frozenset(('drop', 'spill', 'shed'))
+
+    def __init__(
+            self,
+            maxsize: int = 0,
+            overflow: str = 'spill',
+            spill_bytes: int = 1 << 20,
+    ):
+        if overflow not in self.policies:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.spill_bytes = spill_bytes
+        self.stats: Counter = Counter()
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._queue: Deque[Tuple[float, 'IRCMessage']] = deque()
+        self._spill: Deque[Tuple[float, 'IRCMessage']] = deque()
+        self._spill_size = 0
+        self._wakeup = asyncio.Event()
+
+    def qsize(self) -> int:
+        return len(self._queue) + len(self._spill)
+
+    def empty(self) -> bool:
+        return not self._queue
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._queue)
+
+    @staticmethod
+    def _msg_size(msg: 'IRCMessage') -> int:
+        return len((msg.raw or str(msg)).encode())
+
+    def put_nowait(self, msg: 'IRCMessage') -> None:
+        item = (time.monotonic(), msg)
+        if self._spill or self.full():
+            if self.overflow == 'shed':
+                self._queue.popleft()
+                self.stats['shed'] += 1
+            elif self.overflow == 'spill':
+                size = self._msg_size(msg)
+                if self._spill_size + size <= self.spill_bytes:
+                    self._spill.append(item)
+                    self._spill_size += size
+                    self.stats['spilled'] += 1
+                else:
+                    self.stats['dropped'] += 1
+                return
+            else:
+                self.stats['dropped'] += 1
+                return
+        self._queue.append(item)
+        self._wakeup.set()
+
+    def get_nowait(self) -> 'IRCMessage':
+        if not self._queue:
+            raise asyncio.QueueEmpty()
+        timestamp, msg = self._queue.popleft()
+        if self._spill:
+            item = self._spill.popleft()
+            self._spill_size -= self._msg_size(item[1])
+            self._queue.append(item)
+        self.lag = time.monotonic() - timestamp
+        self.max_lag = max(self.max_lag, self.lag)
+        self.stats['delivered'] += 1
+        return msg
+
+    async def get(self) -> 'IRCMessage':
+        while self.empty():
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return self.get_nowait()
@@ -1,12 +1,7 @@
-from .user import IRCUser
+from .user import IRCUser, ParseError
 import re
-import unicodedata
 
-from typing import List, Optional, Iterator
-
-
-class ParseError(Exception):
-    pass
+from typing import Any, Dict, Iterable, List, Match, Optional, Iterator, Tuple
 
 
 class IRCSecurityError(Exception):
@@ -21,7 +16,135 @@ class ExcessiveLengthError(IRCSecurityError):
     pass
 
 
+_message_re = re.compile(
+    r'''
+    (?:
+      @ (?P<tags> \S*)
+    \s+)?
+    (?:
+      (?P<sender>
+        : (?P<nick> [^!\s]+)
+        (?:
+          ! (?P<user> [^@\s]+)
+        )?
+        (?:
+          @ (?P<host> \S*)
+        )?
+      )
+    \s+)?
+    (?P<command> [A-Z]+ | [0-9][0-9][0-9])
+    (?: \s+
+      (?P<args> .*)
+    )?
+    $
+    ''',
+    flags=re.VERBOSE,
+)
+
+_tag_unescapes = {
+    ':': ';',
+    's': ' ',
+    '\\': '\\',
+    'r': '\r',
+    'n': '\n',
+}
+_tag_escapes = {value: f"\\{key}" for key, value in _tag_unescapes.items()}
+_tag_escaped_re = re.compile(r'\\(.?)', flags=re.DOTALL)
+_tag_special_re = re.compile(r'[; \\\r\n]')
+
+
+def parse_tags(tags_str: str) -> Dict[str, str]:
+    """Parse the IRCv3 message tags (without the leading "@")."""
+    tags = {}
+    for tag in tags_str.split(';'):
+        if not tag:
+            continue
+        key, _, value = tag.partition('=')
+        tags[key] = _tag_escaped_re.sub(
+            lambda m: _tag_unescapes.get(m[1], m[1]),
+            value,
+        )
+    return tags
+
+
+def format_tags(tags: Dict[str, str]) -> str:
+    """The inverse of parse_tags()."""
+    return ";".join(
+        f"{key}={_tag_special_re.sub(lambda m: _tag_escapes[m[0]], value)}"
+        if value else key
+        for key, value in tags.items()
+    )
+
+
+def batch_targets(
+        targets: Iterable[str],
+        max_length: int,
+        max_targets: int = None,
+) -> Iterator[str]:
+    """Join the targets into comma-separated lists, like "#a,#b,#c",
+    each at most `max_length` bytes long and with at most
+    `max_targets` targets.
+
+    A target too long to fit any list is yielded on its own.
+
+    """
+    batch: List[str] = []
+    length = 0
+    for target in targets:
+        target_length = len(target.encode())
+        if batch and (
+                length + 1 + target_length > max_length
+                or len(batch) == max_targets
+        ):
+            yield ",".join(batch)
+            batch = []
+        length = length + 1 + target_length if batch else target_length
+        batch.append(target)
+    if batch:
+        yield ",".join(batch)
+
+
+# The Unicode control characters (the Cc category), any of which could
+# end the line early and smuggle another command.
+_control_re = re.compile(r'[\x00-\x1f\x7f-\x9f]')
+
+
+def encode_line(
+        line: str,
+        encoding: str = 'utf-8',
+        sanitize: bool = True,
+) -> bytes:
+    """The line as sent to the server, with the trailing CRLF.
+
+    With `sanitize`, the lines containing the control characters or
+    longer than 512 bytes are refused with an IRCSecurityError.
+
+    """
+    if sanitize and _control_re.search(line):
+        raise InjectionError()
+    data = line.encode(encoding)
+    if sanitize and len(data) > 512:
+        raise ExcessiveLengthError()
+    return data + b"\r\n"
+
+
+# Marks the IRCMessage fields not extracted from the raw line yet.
+_unparsed: Any = object()
+
+
 class IRCMessage:
+    """An IRC message.
+
+    The messages created with parse() only extract the command
+    upfront, the remaining fields are materialized from the regex
+    match on the first access, as most of the plugins look only at
+    the command of most of the messages.
+
+    """
+    __slots__ = (
+        'command', 'raw', '_match', '_args', '_body', '_sender', '_tags',
+    )
+
     def __init__(
             self,
             command: str,
@@ -29,74 +152,85 @@ class IRCMessage:
             sender: IRCUser = None,
             body: str = None,
             raw: str = None,
+            tags: Dict[str, str] = None,
     ):
         self.command: str = command
-        self.args = args
-        self.sender = sender
-        self._body = body
         self.raw = raw
+        self._match: Optional[Match] = None
+        self._args: Tuple[str, ...] = args
+        self._body: Optional[str] = body
+        self._sender: Optional[IRCUser] = sender
+        self._tags: Dict[str, str] = tags or {}
+
+    def _parse_params(self) -> None:
+        assert self._match is not None
+        args_str = self._match.group('args')
+        args: List[str] = []
+        body: Optional[str] = None
+        if args_str:
+            args_str, separator, body_str = args_str.partition(":")
+            if separator:
+                body = body_str
+            args = args_str.split()
+        self._args = tuple(args)
+        self._body = body
+
+    @property
+    def args(self) -> Tuple[str, ...]:
+        if self._args is _unparsed:
+            self._parse_params()
+        return self._args
+
+    @property
+    def trailing(self) -> Optional[str]:
+        """The last parameter if prefixed with a colon, None otherwise."""
+        if self._body is _unparsed:
+            self._parse_params()
+        return self._body
 
     @property
     def body(self) -> str:
-        return self._body or self.args[-1]
+        return self.trailing or self.args[-1]
 
-    def sanitize(self) -> None:
-        def isprintable(string: str) -> bool:
-            return all(not unicodedata.category(c) == 'Cc' for c in string)
+    @property
+    def sender(self) -> Optional[IRCUser]:
+        if self._sender is _unparsed:
+            assert self._match is not None
+            sender_str, nick, user, host = self._match.group(
+                'sender', 'nick', 'user', 'host',
+            )
+            if sender_str:
+                self._sender = IRCUser(nick, user, host, raw=sender_str)
+            else:
+                self._sender = None
+        return self._sender
 
-        if self._body is not None:
-            if not isprintable(self._body):
-                raise InjectionError()
-        for arg in self.args:
-            if not isprintable(arg):
-                raise InjectionError()
+    @property
+    def tags(self) -> Dict[str, str]:
+        if self._tags is _unparsed:
+            assert self._match is not None
+            tags_str = self._match.group('tags')
+            self._tags = parse_tags(tags_str) if tags_str else {}
+        return self._tags
+
+    def sanitize(self) -> None:
+        self.encode()
 
-        if len(str(self).encode()) > 512:
-            raise ExcessiveLengthError()
+    def encode(self, encoding: str = 'utf-8', sanitize: bool = True) -> bytes:
+        """The wire form of the message, see: encode_line()"""
+        return encode_line(str(self), encoding, sanitize)
 
     @classmethod
     def parse(cls, msgstr: str) -> 'IRCMessage':
-        match = re.match(
-            r'''
-            (?:
-              (?P<sender> :\S+)
-            \s+)?
-            (?P<command> [A-Z]+ | [0-9][0-9][0-9])
-            (?: \s+
-              (?P<args> .*)
-            )?
-            $
-            ''',
-            msgstr,
-            flags=re.VERBOSE,
-        )
+        match = _message_re.match(msgstr)
         if match is None:
             raise ParseError(msgstr)
 
-        command = match.group('command')
-
-        sender: Optional[IRCUser] = None
-        sender_str = match.group('sender')
-        if sender_str:
-            sender = IRCUser.parse(sender_str)
-
-        args: List[str] = []
-        body: Optional[str] = None
-        args_str = match.group('args')
-        if args_str:
-            try:
-                args_str, body = args_str.split(":", 1)
-            except ValueError:
-                pass
-            args = args_str.split()
-
-        msg = cls(
-            command,
-            *args,
-            sender=sender,
-            body=body,
-            raw=msgstr,
-        )
+        msg = cls.__new__(cls)
+        msg.command = match.group('command')
+        msg.raw = msgstr
+        msg._match = match
+        msg._args = msg._body = msg._sender = msg._tags = _unparsed
         return msg
 
     def __repr__(self) -> str:
@@ -104,6 +238,9 @@ class IRCMessage:
 
     def __str__(self) -> str:
         def parts() -> Iterator[str]:
+            if self.tags:
+                yield f"@{format_tags(self.tags)}"
+
             if self.sender:
                 yield str(self.sender)
 
@@ -111,8 +248,8 @@ class IRCMessage:
 
             yield from self.args
 
-            if self._body:
-                yield f":{self._body}"
+            if self.trailing:
+                yield f":{self.trailing}"
 
         if self.raw and not self.command:
             return self.raw
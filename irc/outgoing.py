@@ -0,0 +1,192 @@
+from .message import IRCMessage, ParseError
+from collections import Counter, OrderedDict, defaultdict, deque
+from itertools import chain
+import asyncio
+import logging
+
+from typing import Deque, Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+Message = Union[IRCMessage, str]
+# A message along with the future of its outcome, see: put()
+Entry = Tuple[Message, 'asyncio.Future[bool]']
+
+
+class OutgoingQueue:
+    """The outgoing message queue with fair per-target scheduling.
+
+    The protocol-critical commands (`priority_commands`) bypass
+    everything else.  The remaining messages are grouped by their
+    target (a channel or a nick) and the targets are served
+    round-robin, one message at a time, so a long reply in one channel
+    doesn't delay the replies in the others.
+
+    `maxsize` limits the number of pending messages per target (and
+    separately for the priority messages).  What happens to a message
+    that doesn't fit is decided by the overflow policy of its class
+    ("priority" or "chat"):
+
+    - block: the message waits until there is room for it,
+    - drop_oldest: the oldest pending message is discarded,
+    - drop_newest: the new message is discarded,
+    - coalesce: the new message is discarded if an identical one is
+      already pending, otherwise it waits like with "block".
+
+    The outcomes are counted in `stats`.
+
+    """
+    priority_commands = frozenset((
+        'PONG', 'PING', 'PASS', 'CAP', 'USER', 'NICK', 'JOIN', 'PART', 'QUIT',
+    ))
+
+    policies = frozenset(('block', 'drop_oldest', 'drop_newest', 'coalesce'))
+
+    default_overflow = {
+        'priority': 'coalesce',
+        'chat': 'block',
+    }
+
+    def __init__(
+            self,
+            maxsize: int = 0,
+            overflow: Dict[str, str] = None,
+    ):
+        self.maxsize = maxsize
+        self.overflow = dict(self.default_overflow, **(overflow or {}))
+        for policy in self.overflow.values():
+            if policy not in self.policies:
+                raise ValueError(f"Unknown overflow policy: {policy}")
+        self.stats: Counter = Counter()
+        self._priority: Deque[Entry] = deque()
+        self._targets: 'OrderedDict[str, Deque[Entry]]' = OrderedDict()
+        self._waiting: Dict[Optional[str], Deque[Entry]] = defaultdict(deque)
+        self._size = 0
+        self._wakeup = asyncio.Event()
+
+    def classify(self, msg: Message) -> Tuple[bool, str]:
+        """Return whether the message is a priority one and its target."""
+        if isinstance(msg, str):
+            try:
+                msg = IRCMessage.parse(msg)
+            except ParseError:
+                return False, ""
+        if msg.command in self.priority_commands:
+            return True, ""
+        if msg.command in ('PRIVMSG', 'NOTICE') and msg.args:
+            return False, msg.args[0].lower()
+        return False, ""
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def _lane(self, key: Optional[str]) -> Deque[Entry]:
+        if key is None:
+            return self._priority
+        queue = self._targets.get(key)
+        if queue is None:
+            queue = self._targets[key] = deque()
+        return queue
+
+    def _full(self, queue: Deque[Entry]) -> bool:
+        return 0 < self.maxsize <= len(queue)
+
+    def _append(self, queue: Deque[Entry], entry: Entry) -> None:
+        queue.append(entry)
+        self._size += 1
+        self.stats['queued'] += 1
+        self._wakeup.set()
+
+    def put(self, msg: Message) -> 'asyncio.Future[bool]':
+        """Enqueue the message according to the overflow policy.
+
+        Never blocks.  The returned future resolves once the message
+        is either written out by the consumer (True) or discarded
+        (False), so the producers can await it to respect the
+        backpressure, or to know the message really went out.
+
+        """
+        priority, target = self.classify(msg)
+        key = None if priority else target
+        queue = self._lane(key)
+        outcome = asyncio.get_event_loop().create_future()
+
+        if self._waiting.get(key) or self._full(queue):
+            policy = self.overflow['priority' if priority else 'chat']
+            if policy == 'drop_newest':
+                logger.warning("Outgoing queue full, dropping %r", str(msg))
+                self.stats['dropped_newest'] += 1
+                outcome.set_result(False)
+                return outcome
+            elif policy == 'drop_oldest':
+                dropped, dropped_outcome = queue.popleft()
+                self._size -= 1
+                logger.warning(
+                    "Outgoing queue full, dropping %r", str(dropped)
+                )
+                self.stats['dropped_oldest'] += 1
+                resolve(dropped_outcome, False)
+            elif policy == 'coalesce' and any(
+                    str(pending) == str(msg) for pending, _ in chain(
+                        queue, self._waiting.get(key, ()),
+                    )
+            ):
+                self.stats['coalesced'] += 1
+                outcome.set_result(False)
+                return outcome
+            else:
+                self.stats['blocked'] += 1
+                self._waiting[key].append((msg, outcome))
+                return outcome
+
+        self._append(queue, (msg, outcome))
+        return outcome
+
+    def _admit(self, key: Optional[str], queue: Deque[Entry]) -> None:
+        """Move the blocked messages into the freed space."""
+        waiting = self._waiting.get(key)
+        while waiting and not self._full(queue):
+            self._append(queue, waiting.popleft())
+        if not waiting:
+            self._waiting.pop(key, None)
+
+    def get_nowait(self) -> Entry:
+        """The next message and the future of its outcome, to be
+        resolved with resolve() once the message is written out.
+
+        """
+        if self._priority:
+            entry = self._priority.popleft()
+            self._size -= 1
+            self._admit(None, self._priority)
+        elif self._targets:
+            target, queue = next(iter(self._targets.items()))
+            entry = queue.popleft()
+            self._size -= 1
+            self._admit(target, queue)
+            if queue:
+                self._targets.move_to_end(target)
+            else:
+                del self._targets[target]
+        else:
+            raise asyncio.QueueEmpty()
+        return entry
+
+    async def get(self) -> Entry:
+        while self.empty():
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return self.get_nowait()
+
+
+def resolve(outcome: 'asyncio.Future[bool]', written: bool) -> None:
+    """Report the outcome of a message, unless its producer gave up
+    waiting for it already.
+
+    """
+    if not outcome.done():
+        outcome.set_result(written)
@@ -1,14 +1,22 @@
+from .casemapping import casefolder
+from .inbound import PluginQueue
+from .router import CommandRouter
 from functools import wraps
 import asyncio
-import re
 
 from typing import \
-    TYPE_CHECKING, Dict, Any, Awaitable, Callable, Match, Optional
+    TYPE_CHECKING, Dict, Any, Awaitable, Callable, FrozenSet, Match, \
+    Optional, Set, Type, TypeVar
 if TYPE_CHECKING:  # pragma: no cover
     from irc.client import IRCClient    # noqa: F401
     from irc.message import IRCMessage  # noqa: F401
     from irc.user import IRCUser        # noqa: F401
-    import sqlite3                      # noqa: F401
+    from irc.storage import Storage     # noqa: F401
+
+
+# Ordering by the rfc1459 folding, which folds the most characters,
+# is always safe: at worst a few messages get ordered needlessly.
+_fold = casefolder('rfc1459')
 
 
 class NotAuthorizedError(Exception):
@@ -23,6 +31,22 @@ class NotAuthorizedError(Exception):
 
 
 class IRCPlugin:
+    # The IRC commands delivered to this plugin, None meaning all of
+    # them.  A subclass not declaring its own gets all of them, as it
+    # may override react() for any command.  See also: handles()
+    irc_commands: Optional[FrozenSet[str]] = None
+
+    # How many messages may be processed at the same time, and whether
+    # the messages for the same channel should still be processed in
+    # order.  Can be overridden in the plugin config.
+    max_concurrency = 1
+    channel_ordering = False
+
+    def __init_subclass__(cls) -> None:
+        super().__init_subclass__()
+        if 'irc_commands' not in cls.__dict__:
+            cls.irc_commands = None
+
     def __init__(
             self,
             *,
@@ -35,28 +59,56 @@ class IRCPlugin:
         self.logger = self.client.logger.getChild(type(self).__name__)
         self.logger.info("Initalizing plugin.")
 
-        self.queue: asyncio.Queue['IRCMessage'] = asyncio.Queue(queue_size)
-
         self.config = config or {}
 
+        self.queue = PluginQueue(
+            queue_size,
+            overflow=self.config.get('queue_overflow', 'spill'),
+            spill_bytes=self.config.get('spill_bytes', 1 << 20),
+        )
+        self.max_concurrency = self.config.get(
+            'max_concurrency', self.max_concurrency,
+        )
+        self.channel_ordering = self.config.get(
+            'channel_ordering', self.channel_ordering,
+        )
+
         if old_data:
             self.shared_data = old_data
         else:
             self.shared_data = self._shared_data_init()
 
+    async def setup(self) -> None:
+        """Called right after the plugin is created, for the
+        initialization needing to wait, like the database migrations.
+        An exception fails the loading of the plugin.
+
+        """
+        pass
+
     def start(self) -> None:
         """Called when all the plugins are already loaded."""
         pass
 
+    async def cleanup(self) -> None:
+        """Called when the plugin is unloaded, to release the resources
+        not kept in `shared_data`.
+
+        """
+        pass
+
     async def event_loop(self) -> None:
+        if self.max_concurrency > 1:
+            return await self.concurrent_event_loop()
+
         try:
             while True:
                 msg = await self.queue.get()
                 self.logger.debug(
-                    "Queue size on processing: %d", self.queue.qsize()
+                    "Queue size on processing: %d, lag: %.3fs",
+                    self.queue.qsize(), self.queue.lag,
                 )
                 await self.react(msg)
-                self.queue.task_done()
         except asyncio.CancelledError:
             raise
         except Exception:
@@ -67,6 +119,74 @@ class IRCPlugin:
         finally:
             self.logger.info("%s has finished.", self)
 
+    async def concurrent_event_loop(self) -> None:
+        """Like event_loop() but with up to max_concurrency messages
+        processed at the same time.
+
+        An exception while processing one message doesn't stop the
+        processing of the others.
+
+        """
+        slots = asyncio.Semaphore(self.max_concurrency)
+        # The messages taken from the queue, including the ones still
+        # waiting for the previous message from their channel.  Beyond
+        # that, a burst in one channel stays in the queue, subject to
+        # its overflow policy.
+        taken = asyncio.Semaphore(self.max_concurrency + self.queue.maxsize)
+        tasks: Set[asyncio.Future] = set()
+        # The last task started for each channel.
+        channel_tails: Dict[Optional[str], asyncio.Future] = {}
+
+        async def process(
+                msg: 'IRCMessage',
+                previous: Optional[asyncio.Future],
+        ) -> None:
+            try:
+                # Waiting for its turn mustn't take a slot from the
+                # messages of the other channels.
+                if previous is not None:
+                    await asyncio.wait([previous])
+                async with slots:
+                    await self.react(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception(
+                    "%s caused an exception during processing: %s",
+                    self, repr(msg),
+                )
+            finally:
+                taken.release()
+
+        def track_tail(channel: Optional[str], task: asyncio.Future) -> None:
+            def forget(task: asyncio.Future) -> None:
+                if channel_tails.get(channel) is task:
+                    del channel_tails[channel]
+            channel_tails[channel] = task
+            task.add_done_callback(forget)
+
+        try:
+            while True:
+                msg = await self.queue.get()
+                self.logger.debug(
+                    "Queue size on processing: %d, lag: %.3fs",
+                    self.queue.qsize(), self.queue.lag,
+                )
+                await taken.acquire()
+                channel = _fold(msg.args[0]) if msg.args else None
+                previous = None
+                if self.channel_ordering:
+                    previous = channel_tails.get(channel)
+                task = asyncio.ensure_future(process(msg, previous))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if self.channel_ordering:
+                    track_tail(channel, task)
+        finally:
+            for pending in list(tasks):
+                pending.cancel()
+            self.logger.info("%s has finished.", self)
+
     async def react(self, msg: 'IRCMessage') -> Any:
         """React to the received message in some way."""
         pass
@@ -91,7 +211,7 @@ class IRCPlugin:
         )
 
     @property
-    def db(self) -> 'sqlite3.Connection':
+    def db(self) -> 'Storage':
         return self.client.db
 
     def auth(self, sender: 'IRCUser', channel: str) -> None:
@@ -99,13 +219,34 @@ class IRCPlugin:
             raise NotAuthorizedError(sender, channel)
 
 
+PluginType = TypeVar('PluginType', bound=Type[IRCPlugin])
+
+
+def handles(*commands: str) -> Callable[[PluginType], PluginType]:
+    """Declare the IRC commands the decorated plugin class reacts to.
+
+    The commands are added to the ones declared by all its base
+    classes.  Use it without any commands to only receive the ones
+    declared by the base classes.
+
+    """
+    def decorator(cls: PluginType) -> PluginType:
+        cls.irc_commands = frozenset(commands).union(*(
+            vars(base).get('irc_commands') or ()
+            for base in cls.__mro__[1:]
+        ))
+        return cls
+    return decorator
+
+
+@handles('PRIVMSG')
 class IRCCommandPlugin(IRCPlugin):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.commands: Dict[str, Callable[
+        self.commands: CommandRouter[Callable[
             ['IRCUser', str, Match, 'IRCMessage'],
             Awaitable[Optional[bool]],
-        ]] = {}
+        ]] = CommandRouter()
 
     async def react(self, msg: 'IRCMessage') -> Optional[bool]:
         """The return value marks whether to halt the execution of the other
@@ -116,13 +257,11 @@ class IRCCommandPlugin(IRCPlugin):
             assert msg.body is not None
             assert msg.sender is not None
 
-            for command_re, command in self.commands.items():
-                match = re.match(command_re, msg.body)
-                if match:
-                    channel = msg.args[0]
-                    sender = msg.sender
-                    if await command(sender, channel, match, msg):
-                        return True
+            for match, command in self.commands.match(msg.body):
+                channel = msg.args[0]
+                sender = msg.sender
+                if await command(sender, channel, match, msg):
+                    return True
         return await super().react(msg)
 
 
@@ -1,26 +1,44 @@
-from irc.message import IRCMessage
-from irc.plugin import IRCPlugin
+from irc.message import IRCMessage, batch_targets
+from irc.plugin import IRCPlugin, handles
 
-from typing import Set
+from typing import List, Set
 
 
+@handles()
 class ChannelManager(IRCPlugin):
     shared_data: Set[str]
 
     def start(self) -> None:
         super().start()
 
-        channels: Set[str] = set(self.config['channels'])
-        join = channels.difference(self.shared_data)
-        part = self.shared_data.difference(channels)
-        self.shared_data = channels
-
-        for channel in join:
-            self.logger.info("Joining %s…", channel)
-            self.client.send(IRCMessage('JOIN', channel))
-        for channel in part:
-            self.logger.info("Parting %s…", channel)
-            self.client.send(IRCMessage('PART', channel))
+        channels: List[str] = self.config['channels']
+        join = [
+            channel for channel in channels
+            if channel not in self.shared_data
+        ]
+        part = sorted(self.shared_data.difference(channels))
+        self.shared_data = set(channels)
+
+        if join:
+            self.logger.info("Joining %s…", join)
+            self.send_batched('JOIN', join)
+        if part:
+            self.logger.info("Parting %s…", part)
+            self.send_batched('PART', part)
+
+    def send_batched(self, command: str, channels: List[str]) -> None:
+        """Send the command for all the channels with as few lines as
+        possible, as each line counts against the flood control.
+
+        """
+        # 512 bytes per line, including the trailing CRLF.
+        max_length = 510 - len(f"{command} ")
+        for batch in batch_targets(
+                channels,
+                max_length,
+                self.config.get('max_targets'),
+        ):
+            self.client.send(IRCMessage(command, batch))
 
     def _shared_data_init(self) -> Set[str]:
         return set()
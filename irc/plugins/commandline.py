@@ -1,7 +1,13 @@
 from irc.message import IRCMessage
-from irc.plugin import IRCCommandPlugin, NotAuthorizedError, authenticated
+from irc.plugin import (
+    IRCCommandPlugin,
+    NotAuthorizedError,
+    authenticated,
+    handles,
+)
 
 
+@handles()
 class Commandline(IRCCommandPlugin):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -1,26 +1,299 @@
+from irc.cache import TTLCache
 from irc.message import IRCMessage
-from irc.plugin import IRCPlugin
+from irc.plugin import IRCPlugin, handles
 
-from bs4 import BeautifulSoup
+from collections import Counter
+from contextlib import asynccontextmanager
+from html.parser import HTMLParser
+from types import SimpleNamespace
 from urlextract import URLExtract
+from urllib.parse import urlsplit, urlunsplit
 import asyncio
+import codecs
 import httpx
 import re
 
-from typing import Optional
+try:
+    import chardet
+except ImportError:  # pragma: no cover
+    chardet = None
 
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-class HTTPPreview(IRCPlugin):
-    extractor = URLExtract()
 
+_default_ports = {'http': 80, 'https': 443}
+
+_charset_re = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+# Covers both <meta charset="..."> and <meta http-equiv="Content-Type"
+# content="text/html; charset=...">.
+_meta_charset_re = re.compile(
+    rb'<meta\s[^>]*charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE,
+)
+
+# How much of the page to look at for the <meta> charset declaration,
+# as in the HTML standard.
+_sniff_size = 1024
+
+_boms = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+_html_types = frozenset(('text/html', 'application/xhtml+xml'))
+
+# The control characters and the U+FFFD replacement character, the
+# latter standing for the NUL references like "&#0;" or for the bytes
+# not decodable with the page's encoding.  A title containing any of
+# them is either malicious or garbled.
+_garbled_re = re.compile(r'[\x00-\x1f\x7f-\x9f\ufffd]')
+
+# Anything URLExtract could find a URL in has either a scheme or a dot
+# (including the ideographic and fullwidth ones) between two word
+# characters.  The only exception are the scheme-less "localhost" URLs,
+# which are better left alone anyway.
+_url_hint_re = re.compile(r'://|\w[.\u3002\uff0e\uff61]\w')
+
+
+def may_contain_url(text: str) -> bool:
+    """A cheap check whether it's worth looking for URLs in the text."""
+    return bool(_url_hint_re.search(text))
+
+
+def normalize_url(url: str) -> str:
+    """The URL with the parts not affecting the fetched page normalized:
+    the case of the scheme and the host, the default port, the empty
+    path and the fragment.
+
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if ":" in netloc:
+        netloc = f"[{netloc}]"
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+    if port is not None and port != _default_ports.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if parts.username is not None or parts.password is not None:
+        netloc = parts.netloc.rsplit("@", 1)[0] + "@" + netloc
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+class TitleParser(HTMLParser):
+    """An incremental HTML tokenizer looking only for the <title>.
+
+    `done` is set as soon as the title or the whole <head> has been
+    seen, so the rest of the document doesn't need to be read.
+
+    """
+    def __init__(self):
+        super().__init__()
+        self.done = False
+        self._in_title = False
+        self._title: Optional[List[str]] = None
+
+    @property
+    def title(self) -> Optional[str]:
+        if self._title is None:
+            return None
+        return " ".join("".join(self._title).split())
+
+    def handle_starttag(
+            self,
+            tag: str,
+            attrs: List[Tuple[str, Optional[str]]],
+    ) -> None:
+        if tag == 'title' and self._title is None:
+            self._in_title = True
+            self._title = []
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'title' and self._in_title:
+            self._in_title = False
+            self.done = True
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            assert self._title is not None
+            self._title.append(data)
+
+
+def sniff_charset(head: bytes, content_type: str = "") -> str:
+    """The character encoding of an HTML page starting with `head`,
+    judging by its BOM, its Content-Type header or its <meta>
+    declaration, in this order.
+
+    The undeclared encoding is guessed, UTF-8 preferred.
+
+    """
+    for bom, encoding in _boms:
+        if head.startswith(bom):
+            return encoding
+    declared = [
+        match[1] for match in (
+            _charset_re.search(content_type),
+            _meta_charset_re.search(head[:_sniff_size]),
+        )
+        if match
+    ]
+    for charset in declared:
+        if isinstance(charset, bytes):
+            charset = charset.decode('ascii')
+        try:
+            encoding = codecs.lookup(charset).name
+        except LookupError:
+            continue
+        # A page read as UTF-16 can't declare it in ASCII.
+        if encoding.startswith('utf-16'):
+            return 'utf-8'
+        return encoding
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+    except UnicodeDecodeError:
+        pass
+    else:
+        return 'utf-8'
+    guess = chardet.detect(head)['encoding'] if chardet else None
+    # The usual default of the browsers for the legacy pages.
+    return guess or 'cp1252'
+
+
+async def fetch_title(
+        client: httpx.AsyncClient,
+        url: str,
+        max_bytes: int = 1 << 19,
+) -> Optional[str]:
+    """Fetch the title of the HTML page, reading only as much of the page
+    as needed, but at most `max_bytes`.
+
+    Returns None for the pages without a title and the other content
+    types.
+
+    """
+    async with client.stream('GET', url) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('content-type', 'text/html')
+        media_type = content_type.split(';', 1)[0].strip().lower()
+        if media_type not in _html_types:
+            return None
+
+        parser = TitleParser()
+        decoder = None
+        head = b""
+        received = 0
+        async for chunk in response.aiter_bytes():
+            chunk = chunk[:max_bytes - received]
+            received += len(chunk)
+            if decoder is None:
+                # The encoding may be declared only in the page itself.
+                head += chunk
+                if len(head) < _sniff_size and received < max_bytes:
+                    continue
+                decoder = codecs.getincrementaldecoder(
+                    sniff_charset(head, content_type)
+                )(errors='replace')
+                chunk = head
+            parser.feed(decoder.decode(chunk))
+            if parser.done or received >= max_bytes:
+                break
+        if decoder is None:
+            parser.feed(head.decode(
+                sniff_charset(head, content_type), errors='replace',
+            ))
+        return parser.title
+
+
+@handles('PRIVMSG')
+class HTTPPreview(IRCPlugin):
     retries = 3
 
+    max_concurrency = 4
+    # Post the previews in the order of the messages.
+    channel_ordering = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        titles = self.shared_data.titles
+        titles.maxsize = self.config.get('cache_size', 1024)
+        titles.ttl = self.config.get('cache_ttl', 3600)
+        self.negative_ttl = self.config.get('negative_cache_ttl', 300)
+        # The limits of the concurrent fetches: of a single message's
+        # URLs, of all of them and of the ones from a single host.
+        self.message_fetches = self.config.get('message_fetches', 4)
+        self.fetches = asyncio.Semaphore(self.config.get('fetches', 8))
+        self.host_fetches = self.config.get('host_fetches', 2)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._host_users: Counter = Counter()
+        self.http = httpx.AsyncClient()
+
+    async def cleanup(self) -> None:
+        await super().cleanup()
+        await self.http.aclose()
+
+    def _shared_data_init(self):
+        return SimpleNamespace(
+            # The normalized URL -> its title, or None if there was none.
+            titles=TTLCache(),
+            # The normalized URL -> the future of its title.
+            fetching={},
+            # The future of the URLExtract instance, created on the
+            # first use, as loading its TLD list takes a while.
+            extractor=None,
+        )
+
+    async def extract_urls(self, text: str) -> List[str]:
+        if not may_contain_url(text):
+            return []
+        shared_data = self.shared_data
+        if shared_data.extractor is None:
+            loop = asyncio.get_event_loop()
+            shared_data.extractor = loop.run_in_executor(None, URLExtract)
+        loading = shared_data.extractor
+        try:
+            extractor = await asyncio.shield(loading)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if shared_data.extractor is loading:
+                shared_data.extractor = None
+            raise
+        return list(extractor.gen_urls(text))
+
     def get_bad_result(self, url):
         ignores = self.config.get('ignored_titles', {})
         for url_pattern, response_pattern in ignores.items():
             if re.search(url_pattern, url):
                 return response_pattern
 
+    @asynccontextmanager
+    async def fetch_slot(self, url: str) -> AsyncIterator[None]:
+        """Wait until the URL may be fetched without exceeding the
+        global and the per-host limits.
+
+        """
+        host = urlsplit(url).hostname or ""
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.host_fetches)
+        self._host_users[host] += 1
+        try:
+            # The host first, so the fetches waiting for a busy host
+            # don't hold the global slots.
+            async with self._hosts[host], self.fetches:
+                yield
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._hosts[host]
+
     async def generate_preview(
             self,
             client: httpx.AsyncClient,
@@ -31,29 +304,22 @@ class HTTPPreview(IRCPlugin):
 
         for _ in range(0, self.retries):
             self.logger.info("Generating preview for: %s", url)
-            response = await asyncio.wait_for(
-                client.get(url),
-                timeout=self.config.get('timeout', 10),
-            )
-            self.logger.debug("%s fetched.", url)
-            response.raise_for_status()
-            html = response.text
-            loop = asyncio.get_event_loop()
-            soup = await asyncio.wait_for(
-                loop.run_in_executor(
-                    None,
-                    BeautifulSoup, html, 'html.parser',
-                ),
-                # 2 seconds should be a plenty for
-                # sane webpages.
-                timeout=2,
-            )
-            self.logger.debug("%s parsed.", url)
-
-            title: str = " ".join(soup.title.get_text().split())
+            async with self.fetch_slot(url):
+                title = await asyncio.wait_for(
+                    fetch_title(
+                        client, url,
+                        max_bytes=self.config.get('max_bytes', 1 << 19),
+                    ),
+                    timeout=self.config.get('timeout', 10),
+                )
             self.logger.debug(
                 "%s title extracted: %s", url, title
             )
+            if title is None:
+                return None
+            if _garbled_re.search(title):
+                self.logger.warning("Ignoring the garbled title: %r", title)
+                return None
             if bad_result and re.search(bad_result, title):
                 self.logger.info(
                     'The title matched the expected "bad title", retrying…'
@@ -62,6 +328,44 @@ class HTTPPreview(IRCPlugin):
                 return title
         return None
 
+    async def preview(self, url: str) -> Optional[str]:
+        """The cached title of the URL, fetching it if needed.
+
+        Concurrent requests for the same URL share a single fetch.
+
+        """
+        key = normalize_url(url)
+        try:
+            return self.shared_data.titles[key]
+        except KeyError:
+            pass
+
+        fetching = self.shared_data.fetching
+        title = fetching.get(key)
+        if title is None:
+            title = fetching[key] = asyncio.ensure_future(
+                self._fetch_title(url, key)
+            )
+
+            def forget(title: asyncio.Future) -> None:
+                if fetching.get(key) is title:
+                    del fetching[key]
+            title.add_done_callback(forget)
+        return await asyncio.shield(title)
+
+    async def _fetch_title(self, url: str, key: str) -> Optional[str]:
+        titles = self.shared_data.titles
+        try:
+            title = await self.generate_preview(self.http, url)
+        except httpx.HTTPError:
+            titles.set(key, None, self.negative_ttl)
+            raise
+        if title is None:
+            titles.set(key, None, self.negative_ttl)
+        else:
+            titles[key] = title
+        return title
+
     async def react(self, msg: IRCMessage) -> None:
         if msg.command == 'PRIVMSG':
             assert msg.sender is not None
@@ -71,25 +375,51 @@ class HTTPPreview(IRCPlugin):
 
             channel = msg.args[0]
             nick = msg.sender.nick
-            async with httpx.AsyncClient() as client:
-                for url in self.extractor.gen_urls(msg.body):
-                    try:
-                        title = await self.generate_preview(client, url)
-                    except asyncio.TimeoutError:
-                        self.client.send(IRCMessage(
-                            'PRIVMSG', channel,
-                            body=f"{nick}: Preview timed out.",
-                        ))
-                        self.logger.exception(
-                            "Error during processing %s", url
-                        )
-                    except Exception:
-                        self.logger.exception(
-                            "Error during processing %s", url
-                        )
-                    else:
-                        if title:
-                            self.client.send(IRCMessage(
-                                'PRIVMSG', channel,
-                                body=title,
-                            ))
+            slots = asyncio.Semaphore(self.message_fetches)
+
+            async def limited_preview(url: str) -> Optional[str]:
+                async with slots:
+                    return await self.preview(url)
+
+            # All the URLs are fetched concurrently, but the previews
+            # are still sent in order.
+            urls = await self.extract_urls(msg.body)
+            previews = [
+                asyncio.ensure_future(limited_preview(url)) for url in urls
+            ]
+            try:
+                for url, preview in zip(urls, previews):
+                    await self.send_preview(channel, nick, url, preview)
+            finally:
+                for preview in previews:
+                    preview.cancel()
+
+    async def send_preview(
+            self,
+            channel: str,
+            nick: str,
+            url: str,
+            preview: 'asyncio.Future[Optional[str]]',
+    ) -> None:
+        try:
+            title = await preview
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.client.send(IRCMessage(
+                'PRIVMSG', channel,
+                body=f"{nick}: Preview timed out.",
+            ))
+            self.logger.exception(
+                "Error during processing %s", url
+            )
+        except Exception:
+            self.logger.exception(
+                "Error during processing %s", url
+            )
+        else:
+            if title:
+                self.client.send(IRCMessage(
+                    'PRIVMSG', channel,
+                    body=title,
+                ))
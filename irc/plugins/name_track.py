@@ -1,96 +1,461 @@
-from collections import defaultdict
-from irc.message import IRCMessage
-from irc.plugin import IRCPlugin
+from irc.casemapping import casefolder, parse_isupport
+from irc.message import IRCMessage, batch_targets
+from irc.plugin import IRCPlugin, handles
 import asyncio
 
-from typing import Awaitable, Dict, Set
+from typing import (
+    Awaitable, Callable, Dict, Iterable, Iterator, List, MutableSet,
+    Optional, Tuple,
+)
 
 
-# Source: https://stackoverflow.com/a/2912455
-class defaultdict_with_key(defaultdict):
-    def __missing__(self, key):
-        if self.default_factory is None:
-            raise KeyError(key)
-        else:
-            self[key] = self.default_factory(key)
-            return self[key]
+class NickSet(MutableSet[str]):
+    """A set of nicks, the ones differing only in case being the same
+    nick, as on IRC.
 
+    The nicks are kept in their most recently added form: the regular
+    membership test compares them exactly, has() ignores the case.
+    discard() removes the nick in any case.
 
+    """
+    def __init__(
+            self,
+            nicks: Iterable[str] = (),
+            fold: Callable[[str], str] = str.lower,
+    ):
+        # The folded nick -> the nick.
+        self._nicks: Dict[str, str] = {}
+        self.fold = fold
+        self.update(nicks)
+
+    def __contains__(self, nick: object) -> bool:
+        return (
+            isinstance(nick, str)
+            and self._nicks.get(self.fold(nick)) == nick
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._nicks.values())
+
+    def __len__(self) -> int:
+        return len(self._nicks)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({set(self)!r})"
+
+    def has(self, nick: str) -> bool:
+        """Case-insensitive membership test."""
+        return self.fold(nick) in self._nicks
+
+    def add(self, nick: str) -> None:
+        self._nicks[self.fold(nick)] = nick
+
+    def discard(self, nick: str) -> None:
+        self._nicks.pop(self.fold(nick), None)
+
+    def update(self, nicks: Iterable[str]) -> None:
+        for nick in nicks:
+            self.add(nick)
+
+    def refold(self, fold: Callable[[str], str]) -> None:
+        """Switch to another case folding."""
+        self.fold = fold
+        self._nicks = {fold(nick): nick for nick in self._nicks.values()}
+
+
+class NameIndex:
+    """The nicks present on each channel, along with the reverse index
+    of the channels each nick is on.
+
+    The nicks and the channel names are compared according to the
+    server's CASEMAPPING.  The nicks on a channel are loaded with
+    `loader` on the first access.  The changes made while a channel is
+    still loading are replayed on top of the loaded nicks, so nothing
+    ever has to wait for the loading.
+
+    """
+    def __init__(
+            self,
+            loader: Callable[[str], Awaitable[Iterable[str]]],
+            casemapping: str = 'rfc1459',
+    ):
+        self.loader = loader
+        self.casemapping = casemapping
+        self.fold = casefolder(casemapping)
+        # The folded channel -> the channel name and its nicks.
+        self._channels: Dict[str, str] = {}
+        self._names: Dict[str, asyncio.Future] = {}
+        # The folded channel -> the changes made while it's loading.
+        self._journal: Dict[str, List[Callable[[NickSet], None]]] = {}
+        # The folded nick -> the folded channels it's on.
+        self._nick_channels: Dict[str, set] = {}
+        # The NamesRequests of the current NameTrack, so the next one
+        # can take over its pending requests on reload.
+        self.requests: Optional['NamesRequests'] = None
+
+    def __getitem__(self, channel: str) -> 'asyncio.Future[NickSet]':
+        """The nicks on the channel, once they are loaded."""
+        # Whoever waits for the nicks shouldn't be able to cancel the
+        # loading for everyone else.
+        return asyncio.shield(self._loading_task(channel))
+
+    def _loading_task(self, channel: str) -> asyncio.Future:
+        key = self.fold(channel)
+        names = self._names.get(key)
+        if names is None:
+            self._channels[key] = channel
+            self._journal[key] = []
+            names = self._names[key] = asyncio.ensure_future(
+                self._load(channel)
+            )
+            # The failures are reported to whoever waits for the nicks,
+            # possibly no one.
+            names.add_done_callback(
+                lambda task: task.cancelled() or task.exception()
+            )
+        return names
+
+    async def wait(self, channel: str) -> bool:
+        """Wait until the nicks on the channel are loaded.
+
+        Returns False if the server didn't answer in time.  The nicks
+        are unknown then, and get queried again on the next access.
+
+        """
+        try:
+            await self[channel]
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _load(self, channel: str) -> NickSet:
+        try:
+            nicks = await self.loader(channel)
+        except BaseException:
+            key = self.fold(channel)
+            del self._names[key]
+            del self._channels[key]
+            del self._journal[key]
+            raise
+        names = NickSet(nicks, fold=self.fold)
+        for nick in names:
+            self._link(channel, nick)
+        for change in self._journal.pop(self.fold(channel)):
+            change(names)
+        return names
+
+    def _change(
+            self,
+            channel: str,
+            change: Callable[[NickSet], None],
+    ) -> None:
+        """Apply the change to the channel's nicks, or once they are
+        loaded.
+
+        """
+        key = self.fold(channel)
+        if key in self._journal:
+            self._journal[key].append(change)
+        elif key in self._names:
+            change(self._names[key].result())
+
+    def _link(self, channel: str, nick: str) -> None:
+        self._nick_channels.setdefault(
+            self.fold(nick), set()
+        ).add(self.fold(channel))
+
+    def _unlink(self, channel: str, nick: str) -> None:
+        folded = self.fold(nick)
+        channels = self._nick_channels.get(folded)
+        if channels is not None:
+            channels.discard(self.fold(channel))
+            if not channels:
+                del self._nick_channels[folded]
+
+    def is_present(self, channel: str, nick: str) -> bool:
+        """Whether the nick is on the channel, as far as it's known."""
+        return self.fold(channel) in self._nick_channels.get(
+            self.fold(nick), ()
+        )
+
+    def channels_of(self, nick: str) -> List[str]:
+        """The loaded channels the nick is on."""
+        return [
+            self._channels[key]
+            for key in self._nick_channels.get(self.fold(nick), ())
+        ]
+
+    def add(self, channel: str, nick: str) -> None:
+        def change(names: NickSet) -> None:
+            names.add(nick)
+            self._link(channel, nick)
+        self._loading_task(channel)
+        self._change(channel, change)
+
+    def discard(self, channel: str, nick: str) -> None:
+        def change(names: NickSet) -> None:
+            names.discard(nick)
+            self._unlink(channel, nick)
+        self._change(channel, change)
+
+    def quit(self, nick: str) -> List[str]:
+        """Remove the nick from all the channels and return the loaded
+        ones it was on.
+
+        """
+        channels = self.channels_of(nick)
+        for channel in channels + self._loading():
+            self.discard(channel, nick)
+        return channels
+
+    def rename(self, old_nick: str, new_nick: str) -> List[str]:
+        """Rename the nick on all the channels and return the loaded ones
+        it's on.
+
+        """
+        def renaming(channel: str) -> Callable[[NickSet], None]:
+            def change(names: NickSet) -> None:
+                if names.has(old_nick):
+                    names.discard(old_nick)
+                    self._unlink(channel, old_nick)
+                    names.add(new_nick)
+                    self._link(channel, new_nick)
+            return change
+
+        channels = self.channels_of(old_nick)
+        for channel in channels + self._loading():
+            self._change(channel, renaming(channel))
+        return channels
+
+    def _loading(self) -> List[str]:
+        return [self._channels[key] for key in self._journal]
+
+    def set_casemapping(self, casemapping: str) -> None:
+        """Switch to another casemapping, re-indexing the loaded nicks."""
+        if casemapping == self.casemapping:
+            return
+        self.casemapping = casemapping
+        self.fold = casefolder(casemapping)
+        channels = self._channels
+        names = self._names
+        journal = self._journal
+        self._channels = {}
+        self._names = {}
+        self._journal = {}
+        self._nick_channels = {}
+        for key, channel in channels.items():
+            self._channels[self.fold(channel)] = channel
+            self._names[self.fold(channel)] = names[key]
+            if key in journal:
+                self._journal[self.fold(channel)] = journal[key]
+            else:
+                nicks = names[key].result()
+                nicks.refold(self.fold)
+                for nick in nicks:
+                    self._link(channel, nick)
+
+
+class NamesRequests:
+    """Matches the NAMES replies with the pending requests.
+
+    The channels requested in a quick succession are queried with
+    a single "NAMES #a,#b,#c" command, within the line length and the
+    server's TARGMAX limits.  The requests left unanswered for `timeout`
+    seconds fail with asyncio.TimeoutError.  Only the replies to the
+    queries actually sent are collected.
+
+    """
+    def __init__(
+            self,
+            send: Callable[[IRCMessage], object],
+            fold: Callable[[str], str] = casefolder(),
+            timeout: float = 30,
+            batch_delay: float = 0.05,
+            max_targets: int = None,
+            max_length: int = 400,
+    ):
+        self.send = send
+        self.fold = fold
+        self.timeout = timeout
+        self.batch_delay = batch_delay
+        self.max_targets = max_targets
+        self.max_length = max_length
+        # The folded channel -> the future of its nicks and the nicks
+        # received so far.
+        self._pending: Dict[str, Tuple[asyncio.Future, List[str]]] = {}
+        # The folded channel -> the channel, for the queries not yet sent.
+        self._unsent: Dict[str, str] = {}
+        self._flush_handle: Optional[asyncio.Handle] = None
+
+    def request(self, channel: str) -> 'asyncio.Future[List[str]]':
+        """The nicks on the channel, once the server lists them."""
+        key = self.fold(channel)
+        if key in self._pending:
+            return self._pending[key][0]
+        future = asyncio.get_event_loop().create_future()
+        self._enqueue(key, channel, future)
+        return future
+
+    def _enqueue(
+            self,
+            key: str,
+            channel: str,
+            future: 'asyncio.Future[List[str]]',
+    ) -> None:
+        loop = asyncio.get_event_loop()
+        self._pending[key] = (future, [])
+        self._unsent[key] = channel
+        loop.call_later(self.timeout, self._expire, key, future)
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_delay, self.flush)
+
+    def take_over(self, other: 'NamesRequests') -> None:
+        """Query again the channels pending in the other instance and
+        answer its requests from now on.
+
+        The replies to the queries already sent by the other instance
+        may have been lost with its message queue, hence the new ones.
+
+        """
+        if other._flush_handle is not None:
+            other._flush_handle.cancel()
+            other._flush_handle = None
+        for key, (future, _) in other._pending.items():
+            if key not in self._pending and not future.done():
+                # The folded name is just as good for the server.
+                self._enqueue(key, other._unsent.get(key, key), future)
+        other._pending.clear()
+        other._unsent.clear()
+
+    def flush(self) -> None:
+        """Send the queries now."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for batch in batch_targets(
+                self._unsent.values(), self.max_length, self.max_targets,
+        ):
+            self.send(IRCMessage('NAMES', batch))
+        self._unsent.clear()
+
+    def names(self, channel: str, nicks: Iterable[str]) -> None:
+        """Handle RPL_NAMREPLY."""
+        key = self.fold(channel)
+        if key in self._pending and key not in self._unsent:
+            self._pending[key][1].extend(nicks)
+
+    def end(self, channels: str) -> None:
+        """Handle RPL_ENDOFNAMES, possibly for a list of channels."""
+        for channel in channels.split(","):
+            key = self.fold(channel)
+            if key in self._pending and key not in self._unsent:
+                future, nicks = self._pending.pop(key)
+                if not future.done():
+                    future.set_result(nicks)
+
+    def _expire(self, key: str, future: asyncio.Future) -> None:
+        if key in self._pending and self._pending[key][0] is future:
+            del self._pending[key]
+            self._unsent.pop(key, None)
+            if not future.done():
+                future.set_exception(asyncio.TimeoutError())
+
+
+@handles(
+    'JOIN', 'PART', 'QUIT', 'KICK', 'NICK',
+    '005',  # RPL_ISUPPORT
+    '353',  # RPL_NAMREPLY
+    '366',  # RPL_ENDOFNAMES
+)
 class NameTrack(IRCPlugin):
-    shared_data: Dict[str, Awaitable[Set[str]]]
+    shared_data: NameIndex
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.names_requests = NamesRequests(
+            self.client.send,
+            fold=self.shared_data.fold,
+            timeout=self.config.get('names_timeout', 30),
+        )
+        if self.shared_data.requests is not None:
+            self.names_requests.take_over(self.shared_data.requests)
+        # The index outlives the plugin reloads, the loader must not.
+        self.shared_data.loader = self.query_names
+        self.shared_data.requests = self.names_requests
 
     async def react(self, msg: IRCMessage) -> None:
-        async def JOIN(msg: IRCMessage) -> None:
+        def JOIN(msg: IRCMessage) -> None:
             assert msg.sender is not None
             channel = msg.args[0]
             nick = msg.sender.nick
-            await self.acknowledge(channel, nick)
+            self.logger.info("%s joined %s, acknowledging…", nick, channel)
+            self.shared_data.add(channel, nick)
 
-        async def PART(msg: IRCMessage) -> None:
+        def PART(msg: IRCMessage) -> None:
             assert msg.sender is not None
             channel = msg.args[0]
             nick = msg.sender.nick
-            await self.forget(channel, nick)
+            self.logger.info("%s left %s, forgetting…", nick, channel)
+            self.shared_data.discard(channel, nick)
 
-        async def QUIT(msg: IRCMessage) -> None:
+        def QUIT(msg: IRCMessage) -> None:
             assert msg.sender is not None
             nick = msg.sender.nick
-            for channel, nicks in self.shared_data.items():
-                if nick in await nicks:
-                    await self.forget(channel, nick)
+            channels = self.shared_data.quit(nick)
+            self.logger.info("%s quit, forgot on %s", nick, channels)
 
-        async def KICK(msg: IRCMessage) -> None:
+        def KICK(msg: IRCMessage) -> None:
             channel, nick = msg.args
-            await self.forget(channel, nick)
+            self.logger.info("%s left %s, forgetting…", nick, channel)
+            self.shared_data.discard(channel, nick)
 
-        async def NICK(msg: IRCMessage) -> None:
+        def NICK(msg: IRCMessage) -> None:
             assert msg.sender is not None
             old_nick = msg.sender.nick
             new_nick = msg.body
-            await self.rename(old_nick, new_nick)
+            channels = self.shared_data.rename(old_nick, new_nick)
+            self.logger.info(
+                "%s is now known as %s on %s",
+                old_nick, new_nick, channels
+            )
+
+        def RPL_ISUPPORT(msg: IRCMessage) -> None:
+            params = parse_isupport(msg.args[1:])
+            casemapping = params.get('CASEMAPPING')
+            if casemapping:
+                self.logger.info("Using the %s casemapping.", casemapping)
+                self.shared_data.set_casemapping(casemapping)
+                self.names_requests.fold = self.shared_data.fold
+            for limit in (params.get('TARGMAX') or "").split(","):
+                command, _, targets = limit.partition(":")
+                if command.upper() == 'NAMES':
+                    self.names_requests.max_targets = \
+                        int(targets) if targets else None
 
+        def RPL_NAMREPLY(msg: IRCMessage) -> None:
+            self.names_requests.names(
+                msg.args[-1],
+                (nick.lstrip("@+") for nick in msg.body.split()),
+            )
+
+        def RPL_ENDOFNAMES(msg: IRCMessage) -> None:
+            self.names_requests.end(msg.args[-1])
+
+        handlers = {
+            '005': RPL_ISUPPORT,
+            '353': RPL_NAMREPLY,
+            '366': RPL_ENDOFNAMES,
+        }
         if msg.command in ('JOIN', 'PART', 'QUIT', 'KICK', 'NICK'):
-            await locals()[msg.command](msg)
+            locals()[msg.command](msg)
+        elif msg.command in handlers:
+            handlers[msg.command](msg)
 
-    async def query_names(self, channel: str) -> Set[str]:
+    async def query_names(self, channel: str) -> List[str]:
         self.logger.info("No cached names for %s, querying…", channel)
-        self.client.send(IRCMessage('NAMES', channel))
-        names: Set[str] = set()
-        while True:
-            response = await self.queue.get()
-            if response.command == "366":  # RPL_ENDOFNAMES
-                break
-            if response.command == "353":  # RPL_NAMREPLY
-                if response.args[-1] == channel:
-                    names.update(
-                        nick.lstrip("@+")
-                        for nick in response.body.split()
-                    )
+        names = await self.names_requests.request(channel)
         self.logger.info("Nicks on %s: %s", channel, names)
         return names
 
-    async def acknowledge(self, channel: str, nick: str) -> None:
-        self.logger.info("%s joined %s, acknowledging…", nick, channel)
-        names = await self.shared_data[channel]
-        names.add(nick)
-
-    async def forget(self, channel: str, nick: str) -> None:
-        self.logger.info("%s left %s, forgetting…", nick, channel)
-        names = await self.shared_data[channel]
-        names.discard(nick)
-
-    async def rename(self, old_nick: str, new_nick: str) -> None:
-        for channel, nicks_coro in self.shared_data.items():
-            nicks = await nicks_coro
-            if old_nick in nicks:
-                self.logger.info(
-                    "%s is now known as %s on %s",
-                    old_nick, new_nick, channel
-                )
-                nicks.discard(old_nick)
-                nicks.add(new_nick)
-
     def _shared_data_init(self):
-        def factory(channel: str) -> Awaitable[Set[str]]:
-            return asyncio.ensure_future(self.query_names(channel))
-        return defaultdict_with_key(factory)
+        return NameIndex(self.query_names)
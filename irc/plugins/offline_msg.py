@@ -1,14 +1,16 @@
 from collections import defaultdict
 from datetime import datetime
+from irc.ahocorasick import AhoCorasick
 from irc.message import IRCMessage
 from irc.plugin import (
     IRCCommandPlugin,
     IRCPlugin,
     NotAuthorizedError,
     authenticated,
+    handles,
 )
+import asyncio
 import itertools
-import re
 
 
 class OfflineMessagesDynamic(IRCCommandPlugin):
@@ -24,9 +26,14 @@ class OfflineMessagesDynamic(IRCCommandPlugin):
         if not channel.startswith("#"):
             raise NotAuthorizedError(sender, channel)
 
+    def users_changed(self, channel):
+        """Called after the dynamic user list of a channel changes."""
+        pass
+
     @authenticated
     async def __add(self, sender, channel, match, msg):
         self.shared_data[channel].add(match[1])
+        self.users_changed(channel)
         self.client.send(IRCMessage(
             'PRIVMSG', channel,
             body=f"Understood, I'll keep the messages for {match[1]}."
@@ -39,6 +46,7 @@ class OfflineMessagesDynamic(IRCCommandPlugin):
     @authenticated
     async def __del(self, sender, channel, match, msg):
         self.shared_data[channel].discard(match[1])
+        self.users_changed(channel)
         self.client.send(IRCMessage(
             'PRIVMSG', channel,
             body=f"Understood, I'll stop keeping messages for {match[1]}."
@@ -46,23 +54,51 @@ class OfflineMessagesDynamic(IRCCommandPlugin):
         return True
 
 
+@handles('JOIN')
 class OfflineMessages(OfflineMessagesDynamic, IRCPlugin):
+    # How many messages to fetch from the database at a time.
+    dump_page_size = 16
+
+    # Append-only, see: Storage.migrate()
+    schema = [
+        '''
+        CREATE TABLE IF NOT EXISTS offline_msg
+        (
+            time TIMESTAMP,
+            sender STRING,
+            recipient STRING,
+            channel STRING,
+            body STRING
+        )
+        ''',
+        # The rowid is implicitly the last column of every index, so
+        # this one keeps each recipient's messages in order.
+        '''
+        CREATE INDEX IF NOT EXISTS offline_msg_recipient
+        ON offline_msg (channel, recipient)
+        ''',
+    ]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._users = self.config['users']
-        c = self.db.cursor()
-        c.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS offline_msg
-            (
-                time TIMESTAMP,
-                sender STRING,
-                recipient STRING,
-                channel STRING,
-                body STRING
-            )
-            '''
-        )
+        self._detectors = {}
+        self.dump_limit = self.config.get('dump_limit')
+        self._dumps = {}
+        self.commands.update({
+            r'\.more$': self.__more,
+        })
+
+    async def setup(self):
+        await super().setup()
+        await self.db.migrate('offline_msg', self.schema)
+
+    async def event_loop(self):
+        try:
+            await super().event_loop()
+        finally:
+            for task in list(self._dumps.values()):
+                task.cancel()
 
     async def react(self, msg):
         if await super().react(msg):
@@ -70,15 +106,13 @@ class OfflineMessages(OfflineMessagesDynamic, IRCPlugin):
 
         if msg.command == 'PRIVMSG':
             channel = msg.args[0]
-            users = self.users(channel)
-            for user in map(re.escape, users):
-                if re.search(fr"\b{user}\b", msg.body):
-                    await self.store_maybe(msg, user)
+            for user in self.mentions(channel, msg.body):
+                await self.store_maybe(msg, user)
         elif msg.command == 'JOIN':
             channel = msg.args[0]
             users = self.users(channel)
             if msg.sender.nick in users:
-                await self.dump(msg.sender.nick, channel)
+                self.start_dump(msg.sender.nick, channel)
 
     def users(self, channel):
         return itertools.chain(
@@ -86,22 +120,47 @@ class OfflineMessages(OfflineMessagesDynamic, IRCPlugin):
             self.shared_data.get(channel, []),
         )
 
+    def users_changed(self, channel):
+        super().users_changed(channel)
+        self._detectors.pop(channel, None)
+
+    def mentions(self, channel, text):
+        """The users watched on the channel that are mentioned in the text,
+        in the users() order.
+
+        """
+        detector = self._detectors.get(channel)
+        if detector is None:
+            detector = self._detectors[channel] = \
+                AhoCorasick(self.users(channel))
+        found = {user for _, user in detector.search_words(text)}
+        if not found:
+            return []
+        return [
+            user for user in dict.fromkeys(self.users(channel))
+            if user in found
+        ]
+
     async def store_maybe(self, msg, recipient):
         channel = msg.args[0]
         if not channel.startswith("#"):
             # It doesn't make sense to store messages sent directly to
             # the bot.  It was also a possible DoS attack.
             return
-        names = await self.client.shared_data.NameTrack[channel]
-        if recipient in names:
+        names = self.client.shared_data.NameTrack
+        if not await names.wait(channel):
+            # Better to deliver a message needlessly than to lose it.
+            self.logger.warning(
+                "The nicks on %s are unknown, saving anyway.", channel,
+            )
+        if names.is_present(channel, recipient):
             self.logger.info("Not saving, user present.")
         else:
-            self.store(msg, recipient)
+            await self.store(msg, recipient)
 
-    def store(self, msg, recipient):
+    async def store(self, msg, recipient):
         channel = msg.args[0]
-        c = self.db.cursor()
-        c.execute(
+        await self.db.execute(
             '''
             INSERT INTO offline_msg
             (time, sender, recipient, channel, body)
@@ -112,43 +171,106 @@ class OfflineMessages(OfflineMessagesDynamic, IRCPlugin):
         self.db.commit()
         self.logger.info("Storing %s for %s", repr(msg.body), recipient)
 
+    async def __more(self, sender, channel, match, msg):
+        if sender.nick in self.users(channel):
+            self.start_dump(sender.nick, channel)
+        return True
+
     async def dump(self, recipient, channel):
-        c = self.db.cursor()
+        """Send the stored messages, at most `dump_limit` of them.
 
-        c.execute(
-            'SELECT COUNT(*) FROM offline_msg WHERE channel=? AND recipient=?',
-            (channel, recipient)
-        )
-        count = c.fetchone()[0]
-        if count == 0:
+        The messages are fetched a page at a time, and each one is
+        deleted as soon as it's actually been sent.  A restart can at
+        worst repeat the few messages sent since the last commit, but
+        never lose one.
+
+        """
+        limit = self.dump_limit
+        last = 0
+        sent = 0
+        while not limit or sent < limit:
+            size = self.dump_page_size
+            if limit:
+                size = min(size, limit - sent)
+            page = await self.db.execute(
+                '''
+                SELECT rowid, time, sender, body FROM offline_msg
+                WHERE channel=? AND recipient=? AND rowid>?
+                ORDER BY rowid
+                LIMIT ?
+                ''',
+                (channel, recipient, last, size)
+            )
+            outcomes = [
+                self.client.send(IRCMessage(
+                    'PRIVMSG',
+                    channel,
+                    body="{time} <{sender}> {body}".format(
+                        time=timestamp.strftime("%H:%M"),
+                        sender=sender,
+                        body=body,
+                    )
+                ))
+                for rowid, timestamp, sender, body in page
+            ]
+            unsent = 0
+            for (rowid, *_), outcome in zip(page, outcomes):
+                if await outcome:
+                    self.db.execute(
+                        'DELETE FROM offline_msg WHERE rowid=?', (rowid,)
+                    )
+                    self.db.commit()
+                    sent += 1
+                else:
+                    unsent += 1
+            if unsent or len(page) < size:
+                # Either no more messages or the outgoing queue is
+                # dropping them.
+                break
+            last = page[-1][0]
+        if not sent:
             self.logger.info("No messages for %s.", recipient)
             return
-        self.logger.info("Dumping %d messages for %s.", count, recipient)
+        self.logger.info("Dumped %d messages for %s.", sent, recipient)
 
-        c.execute(
-            '''
-            SELECT time, sender, body FROM offline_msg
-            WHERE channel=? AND recipient=?
-            ORDER BY rowid
-            ''',
-            (channel, recipient)
-        )
-        for timestamp, sender, body in c:
-            self.client.send(IRCMessage(
-                'PRIVMSG',
-                channel,
-                body="{time} <{sender}> {body}".format(
-                    time=timestamp.strftime("%H:%M"),
-                    sender=sender,
-                    body=body,
+        if limit and sent >= limit:
+            [(count,)] = await self.db.execute(
+                '''
+                SELECT COUNT(*) FROM offline_msg
+                WHERE channel=? AND recipient=?
+                ''',
+                (channel, recipient)
+            )
+            if count:
+                self.client.send(IRCMessage(
+                    'PRIVMSG', channel,
+                    body=f"{recipient}: {count} more messages waiting,"
+                    " say .more",
+                ))
+
+    def start_dump(self, recipient, channel):
+        """Run dump() in the background, as the flood control may
+        delay the messages for long.  Does nothing if the recipient's
+        messages are being dumped already.
+
+        """
+        key = (channel, recipient)
+        if key in self._dumps:
+            return self._dumps[key]
+
+        def finished(task):
+            del self._dumps[key]
+            if not task.cancelled() and task.exception():
+                self.logger.error(
+                    "Failed to dump the messages for %s.", recipient,
+                    exc_info=task.exception(),
                 )
-            ))
 
-        c.execute(
-            'DELETE FROM offline_msg WHERE channel=? AND recipient=?',
-            (channel, recipient)
+        task = self._dumps[key] = asyncio.ensure_future(
+            self.dump(recipient, channel)
         )
-        self.db.commit()
+        task.add_done_callback(finished)
+        return task
 
     def _shared_data_init(self):
         return defaultdict(set)
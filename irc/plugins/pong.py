@@ -1,7 +1,8 @@
 from irc.message import IRCMessage
-from irc.plugin import IRCPlugin
+from irc.plugin import IRCPlugin, handles
 
 
+@handles('PING')
 class PongPlugin(IRCPlugin):
     async def react(self, msg: IRCMessage) -> None:
         if msg.command == 'PING':
@@ -4,9 +4,137 @@ from irc.plugin import (
     IRCPlugin,
     NotAuthorizedError,
     authenticated,
+    handles,
 )
-import itertools
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import asyncio
 import re
+import string
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+_separator_re = re.compile(r'[^\w+-]')
+
+# SQLite's NOCASE collation only folds the ASCII letters.
+_nocase = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def find_score_change(
+        text: str,
+        is_scorable: Callable[[str], bool],
+) -> Optional[Tuple[str, str]]:
+    """Find the leftmost "++name", "name++", "--name" or "name--" in
+    the text, delimited by the separators (any characters other than
+    the alphanumerics, "_", "+" and "-").  The names may contain the
+    separators too, the longest scorable one is taken.
+
+    Returns the name (as written in the text) and the operator.
+
+    """
+    separators = [match.start() for match in _separator_re.finditer(text)]
+    # The positions the names may start at, ascending…
+    starts = [0] + [pos + 1 for pos in separators]
+    # …and end at, descending, so the longest names are tried first.
+    ends = [len(text)] + separators[::-1]
+    starts_set = set(starts)
+    ends_set = set(ends)
+
+    # The candidates are ordered like the matches of a regex trying
+    # the prefix form first: by the position of the preceding
+    # separator and then by the form.
+    best: Optional[Tuple[int, int, str, str]] = None
+    for operator in ("++", "--"):
+        pos = text.find(operator)
+        while pos != -1:
+            if pos in starts_set:
+                for end in ends:
+                    if end <= pos + 2:
+                        break
+                    name = text[pos+2:end]
+                    if is_scorable(name):
+                        candidate = (max(pos - 1, 0), 0, name, operator)
+                        best = min(best or candidate, candidate)
+                        break
+            if pos + 2 in ends_set:
+                for start in starts:
+                    if start >= pos:
+                        break
+                    name = text[start:pos]
+                    if is_scorable(name):
+                        candidate = (max(start - 1, 0), 1, name, operator)
+                        best = min(best or candidate, candidate)
+                        break
+            pos = text.find(operator, pos + 1)
+
+    if best is None:
+        return None
+    _, _, name, operator = best
+    return name, operator
+
+
+class ChannelScores:
+    """The scores of a single channel, mirroring its score table rows.
+
+    The nicks are compared case-insensitively like in the table, and
+    the scores are also kept sorted for the scoreboards.
+
+    """
+    def __init__(self, rows: Iterable[Tuple[str, int]] = ()):
+        # The folded nick -> the nick as first scored, and the score.
+        self._scores: Dict[str, Tuple[str, int]] = {}
+        # (score, folded nick), ascending.
+        self._ranking: List[Tuple[int, str]] = []
+        for nick, score in rows:
+            key = nick.translate(_nocase)
+            self._scores[key] = (nick, score)
+            self._ranking.append((score, key))
+        self._ranking.sort()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def get(self, nick: str) -> Optional[int]:
+        entry = self._scores.get(nick.translate(_nocase))
+        return None if entry is None else entry[1]
+
+    def change(self, nick: str, change: int) -> int:
+        """Add to the nick's score and return the new score."""
+        key = nick.translate(_nocase)
+        nick, score = self._scores.get(key, (nick, None))
+        if score is not None:
+            self._unrank(score, key)
+            score += change
+        else:
+            score = change
+        self._scores[key] = (nick, score)
+        insort(self._ranking, (score, key))
+        return score
+
+    def remove(self, nick: str) -> None:
+        key = nick.translate(_nocase)
+        entry = self._scores.pop(key, None)
+        if entry is not None:
+            self._unrank(entry[1], key)
+
+    def _unrank(self, score: int, key: str) -> None:
+        del self._ranking[bisect_left(self._ranking, (score, key))]
+
+    def top(
+            self,
+            count: int,
+            descending: bool = True,
+    ) -> List[Tuple[str, int]]:
+        """The nicks and scores of the `count` highest (or lowest)
+        scores.
+
+        """
+        if descending:
+            ranking = self._ranking[:-count-1:-1] if count > 0 else []
+        else:
+            ranking = self._ranking[:count]
+        return [self._scores[key] for _, key in ranking]
 
 
 class UserScoreQueryMixin(IRCCommandPlugin):
@@ -19,7 +147,7 @@ class UserScoreQueryMixin(IRCCommandPlugin):
 
     async def __show_score(self, sender, channel, match, msg):
         scorable = match[1]
-        score = self.score(scorable, channel)
+        score = await self.score(scorable, channel)
         if score is None:
             body = f"{scorable} has no score."
         else:
@@ -49,17 +177,10 @@ class UserScoreQueryMixin(IRCCommandPlugin):
                 body=f"{sender.nick}: Too many scores requested."
             ))
             return
-        c = self.db.cursor()
-        c.execute(
-            f'''
-            SELECT nick, score FROM score
-            WHERE channel=?
-            ORDER BY score {order}
-            LIMIT ?
-            ''',
-            (channel, count)
-        )
-        for nick, score in c:
+        scores = await self.top_scores(channel, count, order == 'DESC')
+        # Not awaiting the sends, the flood control may take a while
+        # and the other messages shouldn't wait for it.
+        for nick, score in scores:
             self.client.send(IRCMessage(
                 'PRIVMSG', channel, body=f"{nick}'s score is {score}."
             ))
@@ -78,35 +199,44 @@ class UserScoreEraseMixin(IRCCommandPlugin):
     @authenticated
     async def __erase_scores(self, sender, channel, match, msg):
         nick = match[1]
-        c = self.db.cursor()
-        c.execute(
-            '''
-            DELETE FROM score
-            WHERE nick=? AND channel=?
-            ''',
-            (nick, channel)
-        )
-        self.db.commit()
+        await self.erase_score(nick, channel)
         self.client.send(IRCMessage(
             'PRIVMSG', channel, body=f"{nick}'s score erased."
         ))
 
 
+@handles()
 class UserScore(UserScoreQueryMixin, UserScoreEraseMixin, IRCPlugin):
+    # Append-only, see: Storage.migrate()
+    schema = [
+        '''
+        CREATE TABLE IF NOT EXISTS score
+        (
+            nick STRING COLLATE NOCASE,
+            channel STRING,
+            score INTEGER,
+            UNIQUE(nick, channel)
+        )
+        ''',
+        # Covers the .scores queries, which don't need to sort anymore.
+        '''
+        CREATE INDEX IF NOT EXISTS score_ranking
+        ON score (channel, score, nick)
+        ''',
+    ]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        c = self.db.cursor()
-        c.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS score
-            (
-                nick STRING COLLATE NOCASE,
-                channel STRING,
-                score INTEGER,
-                UNIQUE(nick, channel)
-            )
-            '''
-        )
+        self.scorables = {
+            scorable.lower() for scorable in self.config['scorables']
+        }
+        # The lazily loaded scores of the recently active channels.
+        self._channels: OrderedDict[str, asyncio.Future] = OrderedDict()
+        self.cached_channels = self.config.get('cached_channels', 64)
+
+    async def setup(self):
+        await super().setup()
+        await self.db.migrate('score', self.schema)
 
     async def react(self, msg):
         await super().react(msg)
@@ -115,33 +245,27 @@ class UserScore(UserScoreQueryMixin, UserScoreEraseMixin, IRCPlugin):
             channel = msg.args[0]
             if not channel.startswith("#"):
                 return
-            names = await self.client.shared_data.NameTrack[channel]
-            scorables = itertools.chain(self.config['scorables'], names)
-            name_re = "|".join(map(re.escape, scorables))
-            operators = ["++", "--"]
-            operator_re = "|".join(map(re.escape, operators))
-            separator_re = r'[^\w+-]'
-            match = re.search(
-                fr'''
-                (?:{separator_re}|^)
-                (?P<op1>{operator_re})
-                (?P<nick1>{name_re})
-                (?:{separator_re}|$)
-                |
-                (?:{separator_re}|^)
-                (?P<nick2>{name_re})
-                (?P<op2>{operator_re})
-                (?:{separator_re}|$)
-                ''',
-                msg.body,
-                flags=(re.VERBOSE | re.IGNORECASE),
-            )
-            if match:
-                nick = match.group('nick1') or match.group('nick2')
-                op = match.group('op1') or match.group('op2')
-                self.respond_score(msg.sender.nick, nick, channel, op)
+            if "++" not in msg.body and "--" not in msg.body:
+                return
+            names = self.client.shared_data.NameTrack
+            if not await names.wait(channel):
+                self.logger.warning(
+                    "The nicks on %s are unknown, only the scorables"
+                    " can be scored.", channel,
+                )
+
+            def is_scorable(name):
+                return (
+                    name.lower() in self.scorables
+                    or names.is_present(channel, name)
+                )
 
-    def respond_score(self, sender, nick, channel, operator):
+            found = find_score_change(msg.body, is_scorable)
+            if found:
+                nick, op = found
+                await self.respond_score(msg.sender.nick, nick, channel, op)
+
+    async def respond_score(self, sender, nick, channel, operator):
         if sender == nick:
             self.client.send(IRCMessage(
                 'PRIVMSG', channel,
@@ -154,31 +278,60 @@ class UserScore(UserScoreQueryMixin, UserScoreEraseMixin, IRCPlugin):
             '--': -1,
         }
         change = value_map[operator]
-        self.change_score(nick, channel, change)
-        score = self.score(nick, channel) or 0
+        score = await self.change_score(nick, channel, change)
         self.client.send(IRCMessage(
             'PRIVMSG', channel,
             body=f"{nick}'s score is now {score}."
         ))
 
-    def score(self, nick, channel):
-        c = self.db.cursor()
-        c.execute(
+    async def channel_scores(self, channel):
+        """The cached scores of the channel, loaded on the first use.
+
+        The writes go to both the cache and the database, so the cache
+        is never stale.  Only the `cached_channels` most recently used
+        channels are kept.
+
+        """
+        scores = self._channels.get(channel)
+        if scores is None:
+            scores = self._channels[channel] = asyncio.ensure_future(
+                self._load_scores(channel)
+            )
+            while len(self._channels) > self.cached_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(channel)
+        try:
+            return await asyncio.shield(scores)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if self._channels.get(channel) is scores:
+                del self._channels[channel]
+            raise
+
+    async def _load_scores(self, channel):
+        rows = await self.db.execute(
             '''
-            SELECT score FROM score
-            WHERE nick=? AND channel=?
+            SELECT nick, score FROM score
+            WHERE channel=?
             ''',
-            (nick, channel)
+            (channel,)
         )
-        value = c.fetchone()
-        if value is None:
-            return None
-        else:
-            return value[0]
+        return ChannelScores(rows)
+
+    async def score(self, nick, channel):
+        scores = await self.channel_scores(channel)
+        return scores.get(nick)
+
+    async def top_scores(self, channel, count, descending=True):
+        scores = await self.channel_scores(channel)
+        return scores.top(count, descending)
 
-    def change_score(self, nick, channel, change):
-        c = self.db.cursor()
-        c.execute(
+    async def change_score(self, nick, channel, change):
+        scores = await self.channel_scores(channel)
+        score = scores.change(nick, change)
+        self.db.execute(
             '''
             INSERT INTO score
             (nick, channel, score)
@@ -189,3 +342,16 @@ class UserScore(UserScoreQueryMixin, UserScoreEraseMixin, IRCPlugin):
             (nick, channel, change, change)
         )
         self.db.commit()
+        return score
+
+    async def erase_score(self, nick, channel):
+        scores = await self.channel_scores(channel)
+        scores.remove(nick)
+        self.db.execute(
+            '''
+            DELETE FROM score
+            WHERE nick=? AND channel=?
+            ''',
+            (nick, channel)
+        )
+        self.db.commit()
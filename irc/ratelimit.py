@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from typing import Callable
+
+
+class TokenBucket:
+    """A token bucket modelled after the usual IRC server flood rules.
+
+    Each line costs its length in bytes plus a fixed per-line penalty.
+    The bucket holds up to `capacity` tokens and refills at `rate`
+    tokens per second, so a short burst of replies goes out at once
+    while a sustained stream gets throttled to the refill rate.
+
+    """
+    def __init__(
+            self,
+            capacity: float,
+            rate: float,
+            penalty: float = 0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        if rate <= 0:
+            raise ValueError(f"The refill rate must be positive: {rate}")
+        self.capacity = capacity
+        self.rate = rate
+        self.penalty = penalty
+        self.clock = clock
+        self._tokens = float(capacity)
+        self._timestamp = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._timestamp) * self.rate,
+        )
+        self._timestamp = now
+
+    @property
+    def level(self) -> float:
+        """The number of tokens currently available."""
+        self._refill()
+        return self._tokens
+
+    def cost(self, data: bytes) -> float:
+        return len(data) + self.penalty
+
+    async def consume(self, cost: float) -> None:
+        """Wait until `cost` tokens are available and take them."""
+        # A line costlier than the whole bucket would never get sent
+        # otherwise, let it drain the bucket completely instead.
+        cost = min(cost, self.capacity)
+        self._refill()
+        while self._tokens < cost:
+            await asyncio.sleep((cost - self._tokens) / self.rate)
+            self._refill()
+        self._tokens -= cost
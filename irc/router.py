@@ -0,0 +1,140 @@
+import re
+
+from typing import (
+    Dict, Iterator, List, Match, MutableMapping, Optional, Pattern, Set,
+    Tuple, TypeVar,
+)
+
+
+Handler = TypeVar('Handler')
+Entry = Tuple[int, Pattern, Handler]
+
+_quantifiers = frozenset('*+?{')
+_special = frozenset('.^$*+?{}[]|()\\')
+
+
+def literal_prefix(pattern: str) -> str:
+    """The literal text every string matched by the pattern starts with.
+
+    Conservative: an empty string is returned whenever in doubt.
+
+    """
+    if _has_toplevel_alternation(pattern):
+        return ""
+    prefix: List[str] = []
+    pos = 0
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == '\\':
+            escaped = pattern[pos+1:pos+2]
+            if not escaped or escaped.isalnum():
+                break
+            prefix.append(escaped)
+            pos += 2
+        elif char in _special:
+            break
+        else:
+            prefix.append(char)
+            pos += 1
+    if pos < len(pattern) and pattern[pos] in _quantifiers and prefix:
+        # The last character might be optional.
+        prefix.pop()
+    return "".join(prefix)
+
+
+def _has_toplevel_alternation(pattern: str) -> bool:
+    depth = 0
+    in_class = False
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            next(chars, None)
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # A "]" right after "[" or "[^" is a literal.
+            char = next(chars, '')
+            if char == '^':
+                char = next(chars, '')
+            if char == '\\':
+                next(chars, None)
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+    return False
+
+
+class CommandRouter(MutableMapping[str, Handler]):
+    """A mapping of the command regexes to their handlers.
+
+    The patterns are compiled once and indexed by their literal
+    prefixes, so matching a message only tries the patterns that can
+    possibly match it, in their registration order.  A message not
+    starting with any of the known prefixes is rejected with a single
+    lookup.
+
+    """
+    def __init__(self, *args, **kwargs):
+        self._handlers: Dict[str, Handler] = {}
+        self._index: Optional[Tuple[
+            Dict[str, List[Entry]], List[Entry], Set[str], List[int],
+        ]] = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, pattern: str) -> Handler:
+        return self._handlers[pattern]
+
+    def __setitem__(self, pattern: str, handler: Handler) -> None:
+        self._handlers[pattern] = handler
+        self._index = None
+
+    def __delitem__(self, pattern: str) -> None:
+        del self._handlers[pattern]
+        self._index = None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._handlers)
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def _build_index(self) -> Tuple[
+            Dict[str, List[Entry]], List[Entry], Set[str], List[int],
+    ]:
+        by_prefix: Dict[str, List[Entry]] = {}
+        unprefixed: List[Entry] = []
+        for order, (pattern, handler) in enumerate(self._handlers.items()):
+            entry = (order, re.compile(pattern), handler)
+            prefix = literal_prefix(pattern)
+            if prefix:
+                by_prefix.setdefault(prefix, []).append(entry)
+            else:
+                unprefixed.append(entry)
+        first_chars = {prefix[0] for prefix in by_prefix}
+        lengths = sorted({len(prefix) for prefix in by_prefix})
+        self._index = (by_prefix, unprefixed, first_chars, lengths)
+        return self._index
+
+    def match(self, text: str) -> Iterator[Tuple[Match, Handler]]:
+        """Yield the matches and handlers of the patterns matching the
+        text, in their registration order.
+
+        """
+        by_prefix, unprefixed, first_chars, lengths = \
+            self._index or self._build_index()
+
+        candidates = list(unprefixed)
+        if text[:1] in first_chars:
+            for length in lengths:
+                if length > len(text):
+                    break
+                candidates.extend(by_prefix.get(text[:length], ()))
+            candidates.sort(key=lambda entry: entry[0])
+        for _, pattern, handler in candidates:
+            match = pattern.match(text)
+            if match:
+                yield match, handler
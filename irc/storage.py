@@ -0,0 +1,172 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import sqlite3
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+
+T = TypeVar('T')
+
+
+class Storage:
+    """The SQLite database shared by the plugins.
+
+    All the queries run on a dedicated thread, so even the slow ones
+    never block the event loop.  execute() submits the query right
+    away and returns a future with the resulting rows; the queries run
+    in the order they were submitted, so it's fine not to await the
+    ones whose result is irrelevant.
+
+    commit() only schedules a commit `commit_delay` seconds later, so
+    all the writes done in the meantime get committed together.  The
+    writes are visible to the later queries right away, only their
+    durability is delayed.  Use flush() to commit immediately.
+
+    """
+    default_pragmas = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY',
+    }
+
+    def __init__(
+            self,
+            path: str = ':memory:',
+            commit_delay: float = 1.0,
+            pragmas: Dict[str, Any] = None,
+    ):
+        self.commit_delay = commit_delay
+        self.stats: Counter = Counter()
+        self._commit_handle: Optional[asyncio.Handle] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='storage',
+        )
+        self.connection: sqlite3.Connection = self._executor.submit(
+            self._connect, path, dict(self.default_pragmas, **(pragmas or {}))
+        ).result()
+
+    @staticmethod
+    def _connect(path: str, pragmas: Dict[str, Any]) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        for pragma, value in pragmas.items():
+            connection.execute(f"PRAGMA {pragma}={value}")
+        return connection
+
+    def _submit(
+            self,
+            function: Callable[..., T],
+            *args: Any,
+    ) -> 'asyncio.Future[T]':
+        return asyncio.wrap_future(self._executor.submit(function, *args))
+
+    def _execute(self, sql: str, parameters: Sequence) -> List[tuple]:
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def execute(
+            self,
+            sql: str,
+            parameters: Sequence = (),
+    ) -> 'asyncio.Future[List[tuple]]':
+        """Run a query on the database thread and return its rows."""
+        return self._submit(self._execute, sql, parameters)
+
+    def run(
+            self,
+            function: Callable[..., T],
+            *args: Any,
+    ) -> 'asyncio.Future[T]':
+        """Call function(connection, *args) on the database thread.
+
+        For the work needing several queries without anything else
+        running in between, like a transaction.
+
+        """
+        return self._submit(
+            lambda: function(self.connection, *args)
+        )
+
+    def _migrate(self, name: str, migrations: Sequence[str]) -> int:
+        connection = self.connection
+        connection.commit()
+        connection.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS schema_version
+            (
+                name TEXT PRIMARY KEY,
+                version INTEGER
+            )
+            '''
+        )
+        rows = connection.execute(
+            'SELECT version FROM schema_version WHERE name=?', (name,)
+        ).fetchall()
+        version = rows[0][0] if rows else 0
+        if version >= len(migrations):
+            return version
+        try:
+            connection.execute('BEGIN')
+            for sql in migrations[version:]:
+                connection.execute(sql)
+            connection.execute(
+                '''
+                INSERT OR REPLACE INTO schema_version
+                (name, version)
+                VALUES (?, ?)
+                ''',
+                (name, len(migrations))
+            )
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        return len(migrations)
+
+    def migrate(
+            self,
+            name: str,
+            migrations: Sequence[str],
+    ) -> 'asyncio.Future[int]':
+        """Bring the schema called `name` up to date.
+
+        `migrations` is the full history of the schema, one statement
+        per version, and is only ever appended to.  The statements not
+        yet applied to this database run in a single transaction.
+        Returns the resulting schema version.
+
+        """
+        return self._submit(self._migrate, name, migrations)
+
+    def _commit(self) -> None:
+        self.connection.commit()
+        self.stats['performed'] += 1
+
+    def commit(self) -> None:
+        """Commit within the next `commit_delay` seconds."""
+        self.stats['requested'] += 1
+        if self.commit_delay <= 0:
+            self.flush()
+        elif self._commit_handle is None:
+            self._commit_handle = asyncio.get_event_loop().call_later(
+                self.commit_delay, self.flush,
+            )
+
+    def flush(self) -> 'asyncio.Future[None]':
+        """Commit now."""
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        return self._submit(self._commit)
+
+    def close(self) -> None:
+        """Commit the pending writes and wait for the database thread."""
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        self._executor.submit(self._commit).result()
+        self._executor.submit(self.connection.close).result()
+        self._executor.shutdown()
@@ -7,7 +7,24 @@ class ParseError(Exception):
     pass
 
 
+_user_re = re.compile(
+    r'''
+    : (?P<nick> [^!]+)
+    (?:
+      ! (?P<user>[^@]+)
+    )?
+    (?:
+      @ (?P<host>.*)
+    )?
+    $
+    ''',
+    flags=re.VERBOSE,
+)
+
+
 class IRCUser:
+    __slots__ = ('nick', 'user', 'host', 'raw')
+
     def __init__(
             self,
             nick: str,
@@ -22,20 +39,7 @@ class IRCUser:
 
     @classmethod
     def parse(cls, userstr: str) -> 'IRCUser':
-        match = re.match(
-            r'''
-            : (?P<nick> [^!]+)
-            (?:
-              ! (?P<user>[^@]+)
-            )?
-            (?:
-              @ (?P<host>.*)
-            )?
-            $
-            ''',
-            userstr,
-            flags=re.VERBOSE,
-        )
+        match = _user_re.match(userstr)
         if match is None:
             raise ParseError(userstr)
 
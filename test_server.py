@@ -121,24 +121,33 @@ class TestIRC:
             '#test-channel2': [bot.nick],
         }
 
-        for _ in channels:
+        # The JOINs may be batched too.
+        joined = []
+        while len(joined) < len(channels):
             join = await client.recv()
-            channel = re.match(r'JOIN (.+)', str(join)).group(1)
-            assert channel in channels
-            await client._send(f"{bot} JOIN {channel}")
-            # The bot should ignore these lines for now.
-            names = channels[channel]
-            for coro in send_names(channel, " ".join(names)):
-                await coro
-
-        for _ in channels:
+            batch = re.match(r'JOIN (.+)', str(join)).group(1)
+            for channel in batch.split(","):
+                assert channel in channels
+                assert channel not in joined
+                joined.append(channel)
+                await client._send(f"{bot} JOIN {channel}")
+                # The bot should ignore these lines for now.
+                names = channels[channel]
+                for coro in send_names(channel, " ".join(names)):
+                    await coro
+
+        # The NAMES requests may be batched.
+        requested = []
+        while len(requested) < len(channels):
             names_request = await client.recv()
-            channel = re.match(r'NAMES (.+)', str(names_request)).group(1)
-            assert channel in channels
-            assert str(names_request) == f"NAMES {channel}"
-            names = channels[channel]
-            for coro in send_names(channel, " ".join(names)):
-                await coro
+            batch = re.match(r'NAMES (.+)', str(names_request)).group(1)
+            for channel in batch.split(","):
+                assert channel in channels
+                assert channel not in requested
+                requested.append(channel)
+                names = channels[channel]
+                for coro in send_names(channel, " ".join(names)):
+                    await coro
 
     @pytest.mark.asyncio
     async def test_04_ping(self, client, host):
@@ -181,6 +190,25 @@ class TestIRC:
                      f" {user.nick}: Ping me again!$",
                      regexp=True),
             SendIgnored(f"{user} PART #test-channel1"),
+
+            # More messages than sent at once.
+            *(SendIgnored(f"{admin} PRIVMSG #test-channel1"
+                          f" :{user.nick}: Message {i}.")
+              for i in range(5)),
+            Send(f"{user} JOIN #test-channel1"),
+            *(Recv(f"PRIVMSG #test-channel1 :{time_re} <{admin.nick}>"
+                   f" {user.nick}: Message {i}\\.$",
+                   regexp=True)
+              for i in range(3)),
+            Recv(f"PRIVMSG #test-channel1 :{user.nick}:"
+                 f" 2 more messages waiting, say .more"),
+            Send(f"{user} PRIVMSG #test-channel1 :.more"),
+            *(Recv(f"PRIVMSG #test-channel1 :{time_re} <{admin.nick}>"
+                   f" {user.nick}: Message {i}\\.$",
+                   regexp=True)
+              for i in range(3, 5)),
+            SendIgnored(f"{user} PRIVMSG #test-channel1 :.more"),
+            SendIgnored(f"{user} PART #test-channel1"),
         ])
 
     @pytest.mark.asyncio
@@ -415,7 +443,15 @@ class TestIRC:
             SendRecv(f"{admin} PRIVMSG #test-channel1"
                      f" :{url}/simple-webpage",
                      "PRIVMSG #test-channel1"
-                     f" :{admin.nick}: Simple Webpage"),
+                     " :Simple Webpage"),
+            SendRecv(f"{admin} PRIVMSG #test-channel1"
+                     f" :{url}/cp1251-webpage",
+                     "PRIVMSG #test-channel1"
+                     " :Простая страница"),
+            SendRecv(f"{admin} PRIVMSG #test-channel1"
+                     f" :{url}/shift-jis-webpage",
+                     "PRIVMSG #test-channel1"
+                     " :簡単なページ"),
             SendIgnored(f"{admin} PRIVMSG #test-channel1"
                         f" :{url}/malicious-webpage"),
             SendIgnored(f"{admin} PRIVMSG #test-channel1"
@@ -431,9 +467,9 @@ class TestIRC:
             Send(f"{admin} PRIVMSG #test-channel1"
                  f" :{url}/simple-webpage and {url}/another-webpage"),
             Recv("PRIVMSG #test-channel1"
-                 f" :{admin.nick}: Simple Webpage"),
+                 " :Simple Webpage"),
             Recv("PRIVMSG #test-channel1"
-                 f" :{admin.nick}: Another Webpage"),
+                 " :Another Webpage"),
         ])
 
     @pytest.mark.asyncio
@@ -448,4 +484,4 @@ class TestIRC:
 
 
 if __name__ == '__main__':
-    pytest.main()
+    pytest.main([__file__])
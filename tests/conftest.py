@@ -0,0 +1,15 @@
+import pytest
+
+
+class Clock:
+    """A fake monotonic clock, moved forward by hand."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
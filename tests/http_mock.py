@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from flask import Flask, redirect
+from flask import Flask, Response, redirect
 import time
 
 
@@ -34,6 +34,38 @@ def http_mock_server():
     def long_webpage():
         return create_title("Long Webpage" * 100)
 
+    @app.route("/cp1251-webpage")
+    def cp1251_webpage():
+        # No charset in the header, only in the page.
+        return Response(
+            create_title("Простая страница").replace(
+                "<head>", '<head><meta charset="windows-1251">'
+            ).encode('cp1251'),
+            content_type="text/html",
+        )
+
+    @app.route("/shift-jis-webpage")
+    def shift_jis_webpage():
+        return Response(
+            create_title("簡単なページ").replace(
+                "<head>",
+                '<head><meta http-equiv="Content-Type"'
+                ' content="text/html; charset=Shift_JIS">'
+            ).encode('shift_jis'),
+            content_type="text/html",
+        )
+
+    @app.route("/large-webpage")
+    def large_webpage():
+        body = "<p>Lorem ipsum dolor sit amet.</p>\n" * 100000
+        return create_title("Large Webpage").replace(
+            "<body>", "<body>" + body
+        )
+
+    @app.route("/large-file")
+    def large_file():
+        return Response(b"\0" * (4 << 20), mimetype="application/zip")
+
     @app.route("/slow-webpage")
     def slow_webpage():
         time.sleep(5)
@@ -0,0 +1,80 @@
+"""The original two-regex IRCMessage.parse, kept as a reference for the
+compatibility tests and the benchmarks.
+
+"""
+
+from irc.message import IRCMessage
+from irc.user import IRCUser, ParseError
+import re
+
+from typing import List, Optional
+
+
+def legacy_parse_user(userstr: str) -> IRCUser:
+    match = re.match(
+        r'''
+        : (?P<nick> [^!]+)
+        (?:
+          ! (?P<user>[^@]+)
+        )?
+        (?:
+          @ (?P<host>.*)
+        )?
+        $
+        ''',
+        userstr,
+        flags=re.VERBOSE,
+    )
+    if match is None:
+        raise ParseError(userstr)
+
+    return IRCUser(
+        nick=match.group('nick'),
+        user=match.group('user'),
+        host=match.group('host'),
+        raw=userstr,
+    )
+
+
+def legacy_parse(msgstr: str) -> IRCMessage:
+    match = re.match(
+        r'''
+        (?:
+          (?P<sender> :\S+)
+        \s+)?
+        (?P<command> [A-Z]+ | [0-9][0-9][0-9])
+        (?: \s+
+          (?P<args> .*)
+        )?
+        $
+        ''',
+        msgstr,
+        flags=re.VERBOSE,
+    )
+    if match is None:
+        raise ParseError(msgstr)
+
+    command = match.group('command')
+
+    sender: Optional[IRCUser] = None
+    sender_str = match.group('sender')
+    if sender_str:
+        sender = legacy_parse_user(sender_str)
+
+    args: List[str] = []
+    body: Optional[str] = None
+    args_str = match.group('args')
+    if args_str:
+        try:
+            args_str, body = args_str.split(":", 1)
+        except ValueError:
+            pass
+        args = args_str.split()
+
+    return IRCMessage(
+        command,
+        *args,
+        sender=sender,
+        body=body,
+        raw=msgstr,
+    )
@@ -0,0 +1,38 @@
+"""The original regex-based score change search of UserScore, kept as
+a reference for the compatibility tests.
+
+"""
+
+import re
+
+from typing import Iterable, Optional, Tuple
+
+
+def legacy_find_score_change(
+        text: str,
+        scorables: Iterable[str],
+) -> Optional[Tuple[str, str]]:
+    name_re = "|".join(map(re.escape, scorables))
+    operators = ["++", "--"]
+    operator_re = "|".join(map(re.escape, operators))
+    separator_re = r'[^\w+-]'
+    match = re.search(
+        fr'''
+        (?:{separator_re}|^)
+        (?P<op1>{operator_re})
+        (?P<nick1>{name_re})
+        (?:{separator_re}|$)
+        |
+        (?:{separator_re}|^)
+        (?P<nick2>{name_re})
+        (?P<op2>{operator_re})
+        (?:{separator_re}|$)
+        ''',
+        text,
+        flags=(re.VERBOSE | re.IGNORECASE),
+    )
+    if match is None:
+        return None
+    nick = match.group('nick1') or match.group('nick2')
+    op = match.group('op1') or match.group('op2')
+    return nick, op
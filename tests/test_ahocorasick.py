@@ -0,0 +1,33 @@
+from irc.ahocorasick import AhoCorasick
+import pytest
+import re
+
+
+USERS = ['ab', 'abc', 'b', 'bca', 'x_y', 'żółw', 'a1']
+
+
+@pytest.mark.parametrize('text', [
+    "",
+    "ab",
+    "abc",
+    "abca",
+    "ab.bca",
+    "xab abc b",
+    "a1 x_y żółwie żółw",
+    "bcab",
+    "ab_",
+])
+def test_search_words_like_regex(text):
+    detector = AhoCorasick(USERS)
+    found = {user for _, user in detector.search_words(text)}
+    assert sorted(found) == sorted(
+        user for user in USERS
+        if re.search(fr"\b{re.escape(user)}\b", text)
+    )
+
+
+def test_search_overlapping():
+    detector = AhoCorasick(['he', 'she', 'his', 'hers'])
+    assert sorted(detector.search("ushers")) == [
+        (1, 'she'), (2, 'he'), (2, 'hers'),
+    ]
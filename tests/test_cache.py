@@ -0,0 +1,29 @@
+from irc.cache import TTLCache
+import pytest
+
+
+def test_ttl(clock):
+    cache = TTLCache(ttl=10, clock=clock)
+    cache['a'] = 1
+    cache.set('b', None, ttl=5)
+    assert cache['a'] == 1
+    assert 'b' in cache and cache['b'] is None
+    clock.now = 5
+    assert 'b' not in cache
+    assert list(cache) == ['a']
+    clock.now = 10
+    with pytest.raises(KeyError):
+        cache['a']
+    assert len(cache) == 0
+
+
+def test_lru():
+    cache = TTLCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert dict(cache) == {'a': 1, 'c': 3}
+    cache['a'] = 4
+    cache['d'] = 5
+    assert dict(cache) == {'a': 4, 'd': 5}
@@ -0,0 +1,71 @@
+from irc import Socket
+from irc.client import IRCClient, RegistrationError, nick_candidates
+import asyncio
+import pytest
+
+
+def test_nick_candidates():
+    assert nick_candidates("Bot", generated=2) == ["Bot", "Bot_", "Bot__"]
+    assert nick_candidates("Bot", ["Alt"], generated=1) == \
+        ["Bot", "Alt", "Bot_"]
+
+
+class Writer:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode().splitlines())
+
+    async def drain(self):
+        pass
+
+
+def registering_client(replies, **config):
+    reader = asyncio.StreamReader()
+    for reply in replies:
+        reader.feed_data(f":server {reply}\r\n".encode())
+    writer = Writer()
+    client = IRCClient(Socket(reader, writer), name="Bot", **config)
+    return client, writer.lines
+
+
+@pytest.mark.asyncio
+async def test_greet_nick_in_use():
+    client, sent = registering_client([
+        "433 * Bot :Nickname is already in use.",
+        "433 * Alt :Nickname is already in use.",
+        # A late reply to an earlier NICK.
+        "433 * Bot :Nickname is already in use.",
+        "001 Bot_ :Welcome",
+    ], nick="Bot", alt_nicks=["Alt"])
+    await client.greet()
+    assert client.nick == "Bot_"
+    assert sent[1:] == ["NICK Bot", "NICK Alt", "NICK Bot_"]
+    client.db.close()
+
+
+@pytest.mark.asyncio
+async def test_greet_nick_exhausted():
+    client, sent = registering_client(
+        [f"433 * Bot{'_' * i} :Nickname is already in use." for i in range(4)]
+        + ["001 Bot____ :Welcome"],
+        nick="Bot",
+    )
+    with pytest.raises(RegistrationError):
+        await client.greet()
+    assert sent[-1] == "NICK Bot___"
+    client.db.close()
+
+
+@pytest.mark.asyncio
+async def test_greet_erroneous_nick():
+    client, sent = registering_client([
+        "432 * VeryLongBot :Erroneous nickname",
+        "432 * AlsoTooLong :Erroneous nickname",
+        "001 VeryLongBot_ :Welcome",
+    ], nick="VeryLongBot", alt_nicks=["AlsoTooLong"])
+    with pytest.raises(RegistrationError):
+        await client.greet()
+    assert sent[1:] == ["NICK VeryLongBot", "NICK AlsoTooLong"]
+    client.db.close()
@@ -0,0 +1,77 @@
+from irc.framing import LineFramer
+import pytest
+
+
+def test_lines():
+    framer = LineFramer()
+    assert framer.feed(b"PING :a\r\nPING :b\r\n") == ["PING :a", "PING :b"]
+    assert len(framer) == 0
+
+
+def test_partial_lines():
+    framer = LineFramer()
+    assert framer.feed(b"PING :a\r\nPI") == ["PING :a"]
+    assert len(framer) == 2
+    assert framer.feed(b"NG :b") == []
+    assert framer.feed(b"\r\n") == ["PING :b"]
+    assert len(framer) == 0
+
+
+@pytest.mark.parametrize('split', range(1, 9))
+def test_split_separator(split):
+    data = b"PING :a\r\nPING :b\r\n"
+    framer = LineFramer()
+    lines = []
+    for pos in range(0, len(data), split):
+        lines += framer.feed(data[pos:pos+split])
+    assert lines == ["PING :a", "PING :b"]
+
+
+def test_split_crlf():
+    framer = LineFramer()
+    assert framer.feed(b"PING :a\r") == []
+    assert framer.feed(b"\nPING :b\r") == ["PING :a"]
+    assert framer.feed(b"\n") == ["PING :b"]
+
+
+def test_empty():
+    framer = LineFramer()
+    assert framer.feed(b"") == []
+    assert framer.feed(b"PING") == []
+    assert framer.feed(b"") == []
+    assert framer.feed(b"\r\n\r\n") == ["PING", ""]
+    assert framer.feed(b"") == []
+
+
+def test_lone_cr_and_lf():
+    framer = LineFramer()
+    assert framer.feed(b"a\rb\nc\r\n") == ["a\rb\nc"]
+
+
+def test_decoding():
+    framer = LineFramer('latin-1')
+    assert framer.feed("zażółć\r\n".encode()) == \
+        ["zażółć".encode().decode('latin-1')]
+    framer = LineFramer()
+    data = "zażółć\r\n".encode()
+    # Cut in the middle of a character.
+    assert framer.feed(data[:3]) == []
+    assert framer.feed(data[3:]) == ["zażółć"]
+
+
+def test_compaction():
+    framer = LineFramer(compact_size=16)
+    line = b"PRIVMSG #a :x\r\n"
+    for _ in range(10):
+        assert framer.feed(line + b"PART") == ["PRIVMSG #a :x"]
+        assert framer.feed(b" #a\r\n") == ["PART #a"]
+    # Everything consumed, nothing kept.
+    assert len(framer._buffer) == 0
+
+    for _ in range(10):
+        framer.feed(line)
+    framer.feed(line + b"partial")
+    assert len(framer) == len(b"partial")
+    # The consumed prefix is dropped once past compact_size.
+    assert len(framer._buffer) <= 16 + len(line) + len(b"partial")
+    assert framer.feed(b"\r\n") == ["partial"]
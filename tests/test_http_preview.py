@@ -0,0 +1,118 @@
+from irc.client import IRCClient
+from irc.plugins.http_preview import (
+    TitleParser, may_contain_url, normalize_url, sniff_charset,
+)
+import codecs
+import pytest
+
+
+@pytest.mark.parametrize('url, normalized', [
+    ("http://example.com", "http://example.com/"),
+    ("HTTP://Example.COM:80/Path?q=1#top", "http://example.com/Path?q=1"),
+    ("https://example.com:443/", "https://example.com/"),
+    ("https://example.com:8443/", "https://example.com:8443/"),
+    ("http://user:pw@Example.com/", "http://user:pw@example.com/"),
+    ("http://[::1]:8080/a", "http://[::1]:8080/a"),
+    ("http://example.com:bad/", "http://example.com:bad/"),
+])
+def test_normalize_url(url, normalized):
+    assert normalize_url(url) == normalized
+
+
+def feed_in_chunks(parser, html, size=3):
+    for pos in range(0, len(html), size):
+        parser.feed(html[pos:pos+size])
+        if parser.done:
+            return pos + size
+    return len(html)
+
+
+def test_title_parser():
+    html = """
+    <html>
+      <head>
+        <meta charset="utf-8">
+        <title>
+          Some &amp;   Title
+        </title>
+      </head>
+      <body><p>Lorem ipsum</p></body>
+    </html>
+    """
+    parser = TitleParser()
+    consumed = feed_in_chunks(parser, html)
+    assert parser.done
+    assert consumed < html.index("</head>")
+    assert parser.title == "Some & Title"
+
+
+@pytest.mark.parametrize('html', [
+    "<html><head><meta charset=utf-8></head><body><title>X</title>",
+    "<html><body><p>Lorem ipsum</p><title>X</title>",
+])
+def test_title_parser_no_title(html):
+    parser = TitleParser()
+    consumed = feed_in_chunks(parser, html)
+    assert parser.done
+    assert consumed < html.index("<title>")
+    assert parser.title is None
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("Hello. How are you?", False),
+    ("No links here", False),
+    ("see example.com", True),
+    ("https://localhost", True),
+    ("http://127.0.0.1:8080/", True),
+    ("example\u3002com", True),
+])
+def test_may_contain_url(text, expected):
+    assert may_contain_url(text) == expected
+
+
+@pytest.mark.parametrize('head, content_type, charset', [
+    (b"<html>", "text/html; charset=ISO-8859-2", 'iso8859-2'),
+    (b"<html>", "text/html; charset=bogus", 'utf-8'),
+    (b'<meta charset="windows-1251">', "text/html", 'cp1251'),
+    (b"<META CHARSET=shift_jis>", "text/html", 'shift_jis'),
+    (
+        b'<meta http-equiv="Content-Type"'
+        b' content="text/html; charset=koi8-r">',
+        "text/html",
+        'koi8-r',
+    ),
+    # The header wins over the page.
+    (b'<meta charset="cp1251">', "text/html; charset=utf-8", 'utf-8'),
+    (codecs.BOM_UTF8 + b'<meta charset="cp1251">', "", 'utf-8'),
+    (b'<meta charset="utf-16">', "", 'utf-8'),
+    ("<title>Zażółć</title>".encode('utf-8'), "text/html", 'utf-8'),
+    # Cut in the middle of a character.
+    ("<title>Zażółć".encode('utf-8')[:-1], "text/html", 'utf-8'),
+])
+def test_sniff_charset(head, content_type, charset):
+    assert sniff_charset(head, content_type) == charset
+
+
+def test_sniff_charset_guess():
+    head = "<title>Zażółć gęślą jaźń</title>".encode('cp1250')
+    assert sniff_charset(head) != 'utf-8'
+
+
+@pytest.mark.asyncio
+async def test_unload_closes_http_client():
+    class HTTPClient:
+        closed = False
+
+        async def aclose(self):
+            self.closed = True
+
+    client = IRCClient(None, nick="Bot")
+    await client.load_plugins(['irc.plugins.http_preview.HTTPPreview'])
+    plugin = client.plugins['HTTPPreview']
+    await plugin.http.aclose()
+    plugin.http = http = HTTPClient()
+    old_data = await client.unload_plugins()
+    assert http.closed
+    assert not client.plugins
+    assert 'HTTPPreview' in old_data
+    client.db.close()
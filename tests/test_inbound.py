@@ -0,0 +1,110 @@
+from irc.inbound import PluginQueue
+from irc.message import IRCMessage
+
+import asyncio
+import pytest
+
+
+def privmsg(text):
+    return IRCMessage.parse(f":nick!user@host PRIVMSG #chan :{text}")
+
+
+def drain(queue):
+    msgs = []
+    while True:
+        try:
+            msgs.append(queue.get_nowait().body)
+        except asyncio.QueueEmpty:
+            return msgs
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        PluginQueue(overflow='block')
+
+
+def test_unbounded():
+    queue = PluginQueue(overflow='drop')
+    for i in range(100):
+        queue.put_nowait(privmsg(i))
+    assert queue.qsize() == 100
+    assert drain(queue) == [str(i) for i in range(100)]
+    assert queue.stats == {'delivered': 100}
+
+
+def test_drop():
+    queue = PluginQueue(2, overflow='drop')
+    for i in range(5):
+        queue.put_nowait(privmsg(i))
+    assert queue.full()
+    assert queue.qsize() == 2
+    assert drain(queue) == ["0", "1"]
+    assert queue.stats == {'dropped': 3, 'delivered': 2}
+
+
+def test_shed():
+    queue = PluginQueue(2, overflow='shed')
+    for i in range(5):
+        queue.put_nowait(privmsg(i))
+    assert queue.qsize() == 2
+    assert drain(queue) == ["3", "4"]
+    assert queue.stats == {'shed': 3, 'delivered': 2}
+
+
+def test_spill():
+    queue = PluginQueue(2, overflow='spill')
+    for i in range(5):
+        queue.put_nowait(privmsg(i))
+    assert queue.qsize() == 5
+    assert queue.stats == {'spilled': 3}
+    assert queue.get_nowait().body == "0"
+    # The spilled messages refill the queue, preserving the order.
+    queue.put_nowait(privmsg(5))
+    assert drain(queue) == ["1", "2", "3", "4", "5"]
+    assert queue.stats == {'spilled': 4, 'delivered': 6}
+    assert queue._spill_size == 0
+
+
+def test_spill_bytes():
+    msg = privmsg("zażółć")
+    size = len(msg.raw.encode())
+    assert size > len(msg.raw)
+
+    queue = PluginQueue(1, overflow='spill', spill_bytes=2 * size)
+    for _ in range(4):
+        queue.put_nowait(privmsg("zażółć"))
+    assert queue.stats == {'spilled': 2, 'dropped': 1}
+    assert queue._spill_size == 2 * size
+
+    queue.get_nowait()
+    assert queue._spill_size == size
+    # The freed space can be spilled into again.
+    queue.put_nowait(privmsg("zażółć"))
+    assert queue.stats['spilled'] == 3
+    assert queue.qsize() == 3
+
+
+def test_lag(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr('irc.inbound.time.monotonic', lambda: now)
+
+    queue = PluginQueue()
+    queue.put_nowait(privmsg("a"))
+    now += 1
+    queue.put_nowait(privmsg("b"))
+    now += 2
+    queue.get_nowait()
+    assert (queue.lag, queue.max_lag) == (3.0, 3.0)
+    queue.get_nowait()
+    assert (queue.lag, queue.max_lag) == (2.0, 3.0)
+
+
+@pytest.mark.asyncio
+async def test_get_waits():
+    queue = PluginQueue(1, overflow='drop')
+    getter = asyncio.ensure_future(queue.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+    queue.put_nowait(privmsg("a"))
+    assert (await asyncio.wait_for(getter, 1)).body == "a"
+    assert queue.empty()
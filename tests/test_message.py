@@ -0,0 +1,161 @@
+from irc.message import \
+    IRCMessage, ParseError, InjectionError, ExcessiveLengthError, \
+    batch_targets, encode_line
+from tests.legacy_message import legacy_parse
+import pytest
+
+
+LINES = [
+    "PING :irc.example.com",
+    "PING irc.example.com",
+    "PING",
+    "PING ",
+    "PING :",
+    ":irc.example.com 001 SoupBot :Welcome to the network SoupBot",
+    ":irc.example.com 353 SoupBot = #channel :@op +voice user",
+    ":irc.example.com 366 SoupBot #channel :End of /NAMES list.",
+    ":irc.example.com 433 * SoupBot :Nickname is already in use.",
+    ":nick!user@host PRIVMSG #channel :Hello, world!",
+    ":nick!user@host PRIVMSG #channel :colons: in: the: body",
+    ":nick!user@host PRIVMSG #channel ::leading colon",
+    ":nick!user@host PRIVMSG #channel :",
+    ":nick!user@host PRIVMSG #channel :  spaced  body  ",
+    ":nick!user@host JOIN #channel",
+    ":nick!user@host JOIN :#channel",
+    ":nick!user@host KICK #channel victim :reason",
+    ":nick!user@host NICK :newnick",
+    ":nick!user@host QUIT :Quit: leaving",
+    ":nick!user@host MODE #channel +b *!*@host:x",
+    ":nick!~user@some.host-name.example.com PART #a",
+    ":nick!user PRIVMSG #a :no host",
+    ":nick@host PRIVMSG #a :no user",
+    ":a!b!c@d PRIVMSG #a :bang in user",
+    ":a!b@c@d PRIVMSG #a :at in host",
+    ":a@b!c@d PRIVMSG #a :at in nick",
+    ":nick!user@ PRIVMSG #a :empty host",
+    ":nick   PRIVMSG   #a   b   :multiple  spaces",
+    ":nick\tPRIVMSG\t#a :tabs",
+    "PRIVMSG #a :trailing newline\n",
+    "PRIVMSG #a :zażółć gęślą jaźń",
+    "NOTICE * :*** Looking up your hostname...",
+    # Invalid lines.
+    "",
+    " ",
+    "privmsg #a :lowercase",
+    "1234 too many digits",
+    "12 too few digits",
+    "PRIVMSG1 #a",
+    ":nick",
+    ":nick!",
+    ":nick! PRIVMSG #a :empty user",
+    ":nick!@host PRIVMSG #a :empty user",
+    ":!user@host PRIVMSG #a :empty nick",
+    ": PRIVMSG #a :empty prefix",
+    "@tag=value",
+]
+
+
+def fields(msg):
+    sender = msg.sender and (
+        msg.sender.nick, msg.sender.user, msg.sender.host, msg.sender.raw
+    )
+    return (msg.command, msg.args, msg.trailing, msg.raw, sender, str(msg))
+
+
+@pytest.mark.parametrize('line', LINES)
+def test_compatibility(line):
+    try:
+        expected = fields(legacy_parse(line))
+    except ParseError:
+        with pytest.raises(ParseError):
+            IRCMessage.parse(line)
+    else:
+        assert fields(IRCMessage.parse(line)) == expected
+
+
+@pytest.mark.parametrize('line, tags', [
+    ("@id=123 PING :x", {'id': '123'}),
+    ("@a=1;b;c= PING :x", {'a': '1', 'b': '', 'c': ''}),
+    ("@key=semi\\:space\\sback\\\\cr\\rlf\\n PING :x",
+     {'key': "semi;space back\\cr\rlf\n"}),
+    ("@key=unknown\\xescape\\ PING :x", {'key': "unknownxescape"}),
+    ("@+example.com/vendor=x;time=2020-01-01T00:00:00.000Z PING :x",
+     {'+example.com/vendor': 'x', 'time': '2020-01-01T00:00:00.000Z'}),
+])
+def test_tags(line, tags):
+    msg = IRCMessage.parse(line)
+    assert msg.tags == tags
+    assert msg.command == 'PING'
+    assert msg.body == 'x'
+
+
+def test_tags_with_prefix():
+    msg = IRCMessage.parse(
+        "@account=nick :nick!user@host PRIVMSG #a :Hello!"
+    )
+    assert msg.tags == {'account': 'nick'}
+    assert msg.sender.nick == 'nick'
+    assert msg.sender.identity == 'user@host'
+    assert msg.args == ('#a',)
+    assert msg.body == 'Hello!'
+
+
+def test_tags_roundtrip():
+    tags = {'a': "semi; space \\ \r\n", 'b': ''}
+    msg = IRCMessage('PRIVMSG', '#a', body="x", tags=tags)
+    assert IRCMessage.parse(str(msg)).tags == tags
+
+
+def test_batch_targets():
+    assert list(batch_targets([], 10)) == []
+    assert list(batch_targets(["#a", "#b", "#c"], 100)) == ["#a,#b,#c"]
+    assert list(batch_targets(["#a", "#b", "#c"], 5)) == ["#a,#b", "#c"]
+    assert list(batch_targets(["#a", "#b", "#c"], 100, 2)) == ["#a,#b", "#c"]
+    assert list(batch_targets(["#a", "#toolong", "#b"], 5)) == \
+        ["#a", "#toolong", "#b"]
+    # The length is counted in bytes.
+    assert list(batch_targets(["#ż", "#b"], 5)) == ["#ż", "#b"]
+
+
+def test_batch_targets_length():
+    channels = [f"#channel{i}" for i in range(200)]
+    batches = list(batch_targets(channels, 505))
+    assert ",".join(batches).split(",") == channels
+    assert all(len(batch) <= 505 for batch in batches)
+    assert len(batches) == 5
+
+
+@pytest.mark.parametrize('line', [
+    "PRIVMSG #a :injected\r\nQUIT",
+    "PRIVMSG #a :newline\n",
+    "PRIVMSG #a :nul\0",
+    "PRIVMSG #a :\x01ACTION waves\x01",
+    "PRIVMSG #a :next line\x85",
+    "PRIVMSG #a\t:tab",
+])
+def test_encode_line_injection(line):
+    with pytest.raises(InjectionError):
+        encode_line(line)
+    assert encode_line(line, sanitize=False) == \
+        line.encode() + b"\r\n"
+
+
+def test_encode_line_length():
+    line = "PRIVMSG #a :" + "x" * 500
+    assert encode_line(line) == line.encode() + b"\r\n"
+    with pytest.raises(ExcessiveLengthError):
+        encode_line(line + "x")
+    # The length is counted in the bytes of the given encoding.
+    with pytest.raises(ExcessiveLengthError):
+        encode_line("PRIVMSG #a :" + "ż" * 251)
+    assert encode_line("PRIVMSG #a :" + "ż" * 251, 'latin2')
+
+
+def test_sanitize():
+    IRCMessage('PRIVMSG', '#a', body="zażółć gęślą jaźń").sanitize()
+    with pytest.raises(InjectionError):
+        IRCMessage('PRIVMSG', '#a', body="a\nQUIT").sanitize()
+    with pytest.raises(InjectionError):
+        IRCMessage('PRIVMSG', '#a\r\nQUIT', body="a").sanitize()
+    with pytest.raises(ExcessiveLengthError):
+        IRCMessage('PRIVMSG', '#a', body="x" * 510).sanitize()
@@ -0,0 +1,183 @@
+from irc.casemapping import casefolder, parse_isupport
+from irc.plugins.name_track import NameIndex, NamesRequests
+import asyncio
+import gc
+import pytest
+
+
+def test_casefolder():
+    assert casefolder('ascii')("Nick[]") == "nick[]"
+    assert casefolder('rfc1459')("Nick[]\\~") == "nick{}|^"
+    assert casefolder('strict-rfc1459')("Nick[]\\~") == "nick{}|~"
+    assert casefolder('unknown')("Nick~") == "nick^"
+
+
+def test_parse_isupport():
+    assert parse_isupport(
+        ["CASEMAPPING=ascii", "EXCEPTS", "-INVEX", "NICKLEN=30"]
+    ) == {'CASEMAPPING': 'ascii', 'EXCEPTS': None, 'NICKLEN': '30'}
+
+
+CHANNELS = {
+    '#one': ["Alice", "bob", "Carol[m]"],
+    '#two': ["alice", "Dave"],
+}
+
+
+@pytest.fixture
+def names():
+    async def loader(channel):
+        return CHANNELS[channel]
+    return NameIndex(loader)
+
+
+@pytest.mark.asyncio
+async def test_name_index(names):
+    for channel in CHANNELS:
+        await names[channel]
+    assert names.is_present('#one', "ALICE")
+    assert names.is_present('#ONE', "carol{M}")
+    assert not names.is_present('#two', "bob")
+    assert sorted(names.channels_of("Alice")) == ['#one', '#two']
+
+    names.add('#two', "Bob")
+    assert sorted(names.channels_of("bob")) == ['#one', '#two']
+    names.discard('#one', "BOB")
+    assert names.channels_of("bob") == ['#two']
+
+
+@pytest.mark.asyncio
+async def test_name_index_quit_and_rename(names):
+    for channel in CHANNELS:
+        await names[channel]
+    assert sorted(names.rename("alice", "Eve")) == ['#one', '#two']
+    assert names.channels_of("alice") == []
+    assert "Eve" in await names['#one']
+    assert sorted(names.quit("eve")) == ['#one', '#two']
+    assert not names.is_present('#one', "Eve")
+    assert not names.is_present('#two', "Eve")
+
+
+@pytest.mark.asyncio
+async def test_name_index_casemapping(names):
+    await names['#one']
+    assert names.is_present('#one', "CAROL{M}")
+    names.set_casemapping('ascii')
+    assert not names.is_present('#one', "CAROL{M}")
+    assert names.is_present('#one', "CAROL[M]")
+    assert (await names['#ONE']).has("carol[m]")
+
+
+@pytest.mark.asyncio
+async def test_name_index_changes_while_loading():
+    loaded = asyncio.get_event_loop().create_future()
+
+    async def loader(channel):
+        return await loaded
+    names = NameIndex(loader)
+
+    names.add('#one', "Alice")
+    names.add('#one', "bob")
+    names.rename("bob", "Bobby")
+    names.rename("carol", "Caroline")
+    names.quit("dave")
+    assert not names.is_present('#one', "Alice")
+    loaded.set_result(["alice", "bob", "carol", "dave"])
+    assert set(await names['#one']) == {"Alice", "Bobby", "Caroline"}
+    assert names.channels_of("bob") == []
+    assert names.channels_of("bobby") == ['#one']
+
+
+@pytest.mark.asyncio
+async def test_names_requests():
+    sent = []
+    requests = NamesRequests(sent.append, batch_delay=0, max_length=20)
+    one = requests.request('#one')
+    two = requests.request('#Two')
+    three = requests.request('#three-long-name')
+    assert requests.request('#one') is one
+
+    # Not queried yet, so this must be an unrelated reply.
+    requests.names('#one', ["someone"])
+    requests.end('#one')
+    assert not one.done()
+
+    await asyncio.sleep(0.01)
+    assert [str(msg) for msg in sent] == [
+        "NAMES #one,#Two",
+        "NAMES #three-long-name",
+    ]
+    requests.names('#ONE', ["alice", "bob"])
+    requests.names('#one', ["carol"])
+    requests.end('#one')
+    requests.end('#two,#three-long-name')
+    assert await one == ["alice", "bob", "carol"]
+    assert await two == []
+    assert await three == []
+
+
+@pytest.mark.asyncio
+async def test_names_requests_timeout():
+    requests = NamesRequests(lambda msg: None, timeout=0, batch_delay=0)
+    with pytest.raises(asyncio.TimeoutError):
+        await requests.request('#one')
+    # A new request is made after the timeout.
+    assert not requests.request('#one').done()
+
+
+@pytest.mark.asyncio
+async def test_name_index_load_timeout():
+    attempts = []
+
+    async def loader(channel):
+        attempts.append(channel)
+        if len(attempts) == 1:
+            raise asyncio.TimeoutError()
+        return CHANNELS[channel]
+    names = NameIndex(loader)
+
+    # Nobody waits for the nicks here, the failure mustn't be reported
+    # as never retrieved.
+    errors = []
+    asyncio.get_event_loop().set_exception_handler(
+        lambda loop, context: errors.append(context)
+    )
+    names.add('#one', "Eve")
+    assert not await names.wait('#one')
+    assert not names.is_present('#one', "Eve")
+    gc.collect()
+    assert errors == []
+
+    # The channel is queried again.
+    assert await names.wait('#one')
+    assert names.is_present('#one', "Alice")
+    assert attempts == ['#one', '#one']
+
+
+@pytest.mark.asyncio
+async def test_names_requests_take_over():
+    sent = []
+    old = NamesRequests(sent.append, batch_delay=0)
+    one = old.request('#one')
+    two = old.request('#two')
+    await asyncio.sleep(0.01)
+    three = old.request('#three')
+
+    new = NamesRequests(sent.append, batch_delay=0)
+    new.take_over(old)
+    await asyncio.sleep(0.01)
+    assert [str(msg) for msg in sent] == [
+        "NAMES #one,#two",
+        "NAMES #one,#two,#three",
+    ]
+    # The old instance neither sends nor collects anything anymore.
+    old.flush()
+    old.end('#one')
+    assert not one.done()
+    assert len(sent) == 2
+
+    new.names('#one', ["alice"])
+    new.end('#one,#two,#three')
+    assert await one == ["alice"]
+    assert await two == []
+    assert await three == []
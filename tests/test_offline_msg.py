@@ -0,0 +1,138 @@
+from irc.client import IRCClient
+from irc.message import IRCMessage
+from irc.outgoing import resolve
+import asyncio
+import pytest
+
+
+@pytest.fixture
+async def client():
+    client = IRCClient(None, nick="Bot")
+    await client.load_plugins([
+        {'irc.plugins.offline_msg.OfflineMessages': {
+            'admin': [],
+            'dump_limit': 3,
+            'users': {'#channel': ["bob"]},
+        }},
+    ])
+    yield client
+    client.db.close()
+
+
+class Writer:
+    """Stands in for the IRCClient's writer, failing to send the
+    lines ending with any of the `failing` strings.
+
+    """
+    def __init__(self, client, failing=()):
+        self.client = client
+        self.failing = set(failing)
+        self.lines = []
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            msg, outcome = await self.client.outgoing_queue.get()
+            written = not any(map(msg.body.endswith, self.failing))
+            if written:
+                self.lines.append(msg.body)
+            resolve(outcome, written)
+
+    async def take(self):
+        await asyncio.sleep(0.01)
+        lines, self.lines = self.lines, []
+        return lines
+
+
+async def store(client, *bodies):
+    plugin = client.plugins['OfflineMessages']
+    for body in bodies:
+        msg = IRCMessage.parse(f":alice!a@host PRIVMSG #channel :{body}")
+        await plugin.store(msg, "bob")
+
+
+async def stored(client):
+    rows = await client.db.execute('SELECT body FROM offline_msg')
+    return [body for body, in rows]
+
+
+def bodies(lines):
+    return [line.partition(" <alice> ")[2] or line for line in lines]
+
+
+@pytest.mark.asyncio
+async def test_dump_pages(client):
+    plugin = client.plugins['OfflineMessages']
+    plugin.dump_page_size = 2
+    writer = Writer(client)
+    try:
+        await store(client, *(f"bob: message {i}" for i in range(5)))
+        await plugin.dump("bob", "#channel")
+        assert bodies(await writer.take()) == [
+            "bob: message 0",
+            "bob: message 1",
+            "bob: message 2",
+            "bob: 2 more messages waiting, say .more",
+        ]
+        assert await stored(client) == ["bob: message 3", "bob: message 4"]
+
+        more = IRCMessage.parse(":bob!b@host PRIVMSG #channel :.more")
+        await plugin.react(more)
+        await asyncio.gather(*plugin._dumps.values())
+        assert bodies(await writer.take()) == [
+            "bob: message 3",
+            "bob: message 4",
+        ]
+        assert await stored(client) == []
+
+        await plugin.react(more)
+        await asyncio.gather(*plugin._dumps.values())
+        assert await writer.take() == []
+    finally:
+        writer.task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_dump_unsent(client):
+    plugin = client.plugins['OfflineMessages']
+    writer = Writer(client)
+    try:
+        await store(client, "bob: one", "bob: two", "bob: three")
+        writer.failing = {"bob: two"}
+        await plugin.dump("bob", "#channel")
+        assert bodies(await writer.take()) == ["bob: one", "bob: three"]
+        # Only the unsent message is kept.
+        assert await stored(client) == ["bob: two"]
+
+        writer.failing = set()
+        await plugin.dump("bob", "#channel")
+        assert bodies(await writer.take()) == ["bob: two"]
+        assert await stored(client) == []
+    finally:
+        writer.task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_dump_in_background(client):
+    plugin = client.plugins['OfflineMessages']
+    await store(client, "bob: one", "bob: two", "bob: three")
+    join = IRCMessage.parse(":bob!b@host JOIN #channel")
+    # Nothing writes the messages out yet, as if the flood control
+    # held them back.
+    await asyncio.wait_for(plugin.react(join), 1)
+    await asyncio.wait_for(plugin.react(join), 1)
+    assert len(plugin._dumps) == 1
+    await asyncio.sleep(0.01)
+
+    entries = [client.outgoing_queue.get_nowait() for _ in range(3)]
+    assert client.outgoing_queue.empty()
+    assert await stored(client) == ["bob: one", "bob: two", "bob: three"]
+    # Each message is deleted as soon as it's written.
+    resolve(entries[0][1], True)
+    await asyncio.sleep(0.01)
+    assert await stored(client) == ["bob: two", "bob: three"]
+    for _, outcome in entries[1:]:
+        resolve(outcome, True)
+    await asyncio.gather(*plugin._dumps.values())
+    assert await stored(client) == []
+    assert not plugin._dumps
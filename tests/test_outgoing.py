@@ -0,0 +1,157 @@
+from irc.message import IRCMessage
+from irc.outgoing import OutgoingQueue, resolve
+import asyncio
+import pytest
+
+
+def privmsg(target, body):
+    return IRCMessage('PRIVMSG', target, body=body)
+
+
+def drain(queue):
+    """Write out all the queued messages, returning them as strings."""
+    lines = []
+    while not queue.empty():
+        msg, outcome = queue.get_nowait()
+        resolve(outcome, True)
+        lines.append(str(msg))
+    return lines
+
+
+@pytest.mark.asyncio
+async def test_fairness():
+    queue = OutgoingQueue()
+    for i in range(3):
+        queue.put(privmsg('#a', f"a{i}"))
+    queue.put(privmsg('#B', "b0"))
+    queue.put(privmsg('#b', "b1"))
+    queue.put(privmsg('nick', "n0"))
+    assert drain(queue) == [
+        "PRIVMSG #a :a0",
+        "PRIVMSG #B :b0",
+        "PRIVMSG nick :n0",
+        "PRIVMSG #a :a1",
+        "PRIVMSG #b :b1",
+        "PRIVMSG #a :a2",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_priority():
+    queue = OutgoingQueue()
+    queue.put(privmsg('#a', "a0"))
+    queue.put(IRCMessage('JOIN', '#b'))
+    queue.put("PONG :server")
+    queue.put("PRIVMSG #a :a1")
+    assert drain(queue) == [
+        "JOIN #b",
+        "PONG :server",
+        "PRIVMSG #a :a0",
+        "PRIVMSG #a :a1",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_outcome():
+    queue = OutgoingQueue()
+    written = queue.put(privmsg('#a', "a0"))
+    unsent = queue.put(privmsg('#a', "a1"))
+    assert not written.done()
+    _, outcome = queue.get_nowait()
+    resolve(outcome, True)
+    _, outcome = queue.get_nowait()
+    resolve(outcome, False)
+    assert await written is True
+    assert await unsent is False
+    # The producer may stop waiting, the outcome is then ignored.
+    cancelled = queue.put(privmsg('#a', "a2"))
+    cancelled.cancel()
+    _, outcome = queue.get_nowait()
+    resolve(outcome, True)
+
+
+@pytest.mark.asyncio
+async def test_block():
+    queue = OutgoingQueue(maxsize=2)
+    first = queue.put(privmsg('#a', "a0"))
+    queue.put(privmsg('#a', "a1"))
+    blocked = queue.put(privmsg('#a', "a2"))
+    other = queue.put(privmsg('#b', "b0"))
+    assert queue.qsize() == 3
+    assert queue.stats['blocked'] == 1
+    _, outcome = queue.get_nowait()
+    resolve(outcome, True)
+    assert await first is True
+    # Admitted into the freed space, but not written yet.
+    assert queue.qsize() == 3
+    assert not blocked.done()
+    assert drain(queue) == [
+        "PRIVMSG #b :b0",
+        "PRIVMSG #a :a1",
+        "PRIVMSG #a :a2",
+    ]
+    assert await blocked is True
+    assert await other is True
+
+
+@pytest.mark.asyncio
+async def test_drop_newest():
+    queue = OutgoingQueue(maxsize=1, overflow={'chat': 'drop_newest'})
+    kept = queue.put(privmsg('#a', "a0"))
+    dropped = queue.put(privmsg('#a', "a1"))
+    assert await dropped is False
+    assert queue.stats['dropped_newest'] == 1
+    assert drain(queue) == ["PRIVMSG #a :a0"]
+    assert await kept is True
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest():
+    queue = OutgoingQueue(maxsize=2, overflow={'chat': 'drop_oldest'})
+    dropped = queue.put(privmsg('#a', "a0"))
+    kept = queue.put(privmsg('#a', "a1"))
+    newest = queue.put(privmsg('#a', "a2"))
+    assert await dropped is False
+    assert queue.stats['dropped_oldest'] == 1
+    assert drain(queue) == ["PRIVMSG #a :a1", "PRIVMSG #a :a2"]
+    assert await kept is True
+    assert await newest is True
+
+
+@pytest.mark.asyncio
+async def test_coalesce():
+    queue = OutgoingQueue(maxsize=1)
+    queue.put(IRCMessage('JOIN', '#a'))
+    duplicate = queue.put(IRCMessage('JOIN', '#a'))
+    different = queue.put(IRCMessage('JOIN', '#b'))
+    assert await duplicate is False
+    assert queue.stats['coalesced'] == 1
+    assert not different.done()
+    assert drain(queue) == ["JOIN #a", "JOIN #b"]
+    assert await different is True
+
+    # The messages already waiting for room count too.
+    queue.put(IRCMessage('JOIN', '#a'))
+    waiting = queue.put(IRCMessage('JOIN', '#b'))
+    duplicate = queue.put(IRCMessage('JOIN', '#b'))
+    assert duplicate.done() and duplicate.result() is False
+    assert queue.stats['coalesced'] == 2
+    assert not waiting.done()
+    assert drain(queue) == ["JOIN #a", "JOIN #b"]
+    assert await waiting is True
+
+
+@pytest.mark.asyncio
+async def test_get_waits():
+    queue = OutgoingQueue()
+    getter = asyncio.ensure_future(queue.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+    queue.put(privmsg('#a', "a0"))
+    msg, _ = await asyncio.wait_for(getter, 1)
+    assert str(msg) == "PRIVMSG #a :a0"
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        OutgoingQueue(overflow={'chat': 'explode'})
@@ -0,0 +1,134 @@
+from irc.client import IRCClient
+from irc.message import IRCMessage
+from irc.plugin import IRCCommandPlugin, IRCPlugin, handles
+from irc.plugins.commandline import Commandline
+from irc.plugins.offline_msg import OfflineMessages
+from irc.plugins.user_score import UserScore
+import asyncio
+import pytest
+
+
+@handles('JOIN')
+class Joins(IRCPlugin):
+    pass
+
+
+@handles('PART')
+class Parts(IRCPlugin):
+    pass
+
+
+def test_handles():
+    assert IRCPlugin.irc_commands is None
+    assert IRCCommandPlugin.irc_commands == {'PRIVMSG'}
+    assert Commandline.irc_commands == {'PRIVMSG'}
+    assert UserScore.irc_commands == {'PRIVMSG'}
+    assert OfflineMessages.irc_commands == {'PRIVMSG', 'JOIN'}
+
+
+def test_handles_multiple_inheritance():
+    @handles('QUIT')
+    class Both(Joins, Parts):
+        pass
+    assert Both.irc_commands == {'JOIN', 'PART', 'QUIT'}
+
+    @handles()
+    class Inherited(Parts, Joins):
+        pass
+    assert Inherited.irc_commands == {'JOIN', 'PART'}
+
+
+def test_undeclared_subclass():
+    class Everything(Joins):
+        async def react(self, msg):
+            pass
+    assert Everything.irc_commands is None
+
+    class Commands(IRCCommandPlugin):
+        pass
+    assert Commands.irc_commands is None
+
+    class Declared(Joins):
+        irc_commands = frozenset(('NICK',))
+    assert Declared.irc_commands == {'NICK'}
+
+
+class Gated(IRCPlugin):
+    """Reacts to each message only once it's let through."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = []
+        self.gates = {}
+
+    async def react(self, msg):
+        self.running.append(msg.body)
+        try:
+            gate = self.gates[msg.body] = \
+                asyncio.get_event_loop().create_future()
+            await gate
+        finally:
+            self.running.remove(msg.body)
+
+    async def let_through(self, body):
+        self.gates[body].set_result(None)
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+async def gated():
+    client = IRCClient(None, nick="Bot")
+    plugins = []
+
+    def make(**config):
+        plugin = Gated(client=client, queue_size=8, config=config)
+        plugins.append(asyncio.ensure_future(plugin.event_loop()))
+        return plugin
+    yield make
+    for task in plugins:
+        task.cancel()
+    await asyncio.gather(*plugins, return_exceptions=True)
+    client.db.close()
+
+
+async def say(plugin, *messages):
+    for channel, body in messages:
+        plugin.queue.put_nowait(
+            IRCMessage.parse(f":alice!a@host PRIVMSG {channel} :{body}")
+        )
+    await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_concurrency(gated):
+    plugin = gated(max_concurrency=2)
+    await say(plugin, ('#a', "a1"), ('#a', "a2"), ('#b', "b1"))
+    assert plugin.running == ["a1", "a2"]
+    await plugin.let_through("a2")
+    assert plugin.running == ["a1", "b1"]
+
+
+@pytest.mark.asyncio
+async def test_channel_ordering(gated):
+    plugin = gated(max_concurrency=2, channel_ordering=True)
+    await say(
+        plugin,
+        ('#a', "a1"), ('#A', "a2"), ('#a', "a3"), ('#b', "b1"), ('#c', "c1"),
+    )
+    # The messages waiting for their turn don't hold up the others.
+    assert plugin.running == ["a1", "b1"]
+    await plugin.let_through("b1")
+    assert plugin.running == ["a1", "c1"]
+    await plugin.let_through("a1")
+    assert plugin.running == ["c1", "a2"]
+    await plugin.let_through("a2")
+    assert plugin.running == ["c1", "a3"]
+
+
+@pytest.mark.asyncio
+async def test_concurrency_exception(gated):
+    plugin = gated(max_concurrency=2)
+    await say(plugin, ('#a', "a1"))
+    plugin.gates["a1"].set_exception(ValueError())
+    await say(plugin, ('#a', "a2"))
+    assert plugin.running == ["a2"]
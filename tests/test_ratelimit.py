@@ -0,0 +1,61 @@
+from irc.client import IRCClient
+from irc.ratelimit import TokenBucket
+import logging
+import pytest
+import time
+
+
+def test_refill(clock):
+    bucket = TokenBucket(capacity=100, rate=10, clock=clock)
+    assert bucket.level == 100
+    bucket._tokens = 0
+    clock.now += 2
+    assert bucket.level == 20
+    clock.now += 100
+    assert bucket.level == 100
+
+
+def test_cost():
+    bucket = TokenBucket(capacity=100, rate=10, penalty=64)
+    assert bucket.cost(b"PING :x\r\n") == 9 + 64
+
+
+@pytest.mark.asyncio
+async def test_consume(clock):
+    bucket = TokenBucket(capacity=100, rate=10, clock=clock)
+    await bucket.consume(60)
+    assert bucket.level == 40
+    clock.now += 1
+    await bucket.consume(50)
+    assert bucket.level == 0
+
+
+@pytest.mark.asyncio
+async def test_consume_waits():
+    bucket = TokenBucket(capacity=10, rate=1000)
+    await bucket.consume(10)
+    start = time.monotonic()
+    await bucket.consume(10)
+    assert time.monotonic() - start >= 0.009
+
+
+@pytest.mark.asyncio
+async def test_consume_clamped():
+    bucket = TokenBucket(capacity=10, rate=1000)
+    # Costlier than the whole bucket, drains it instead of waiting
+    # forever.
+    await bucket.consume(1000)
+    assert bucket.level < 1
+
+
+@pytest.mark.parametrize('rate', [0, -1])
+def test_invalid_rate(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(capacity=10, rate=rate)
+
+
+def test_obsolete_delay(caplog):
+    with caplog.at_level(logging.WARNING):
+        client = IRCClient(None, nick="Bot", delay=2)
+    client.db.close()
+    assert "delay" in caplog.text
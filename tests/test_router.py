@@ -0,0 +1,65 @@
+from irc.router import CommandRouter, literal_prefix
+import pytest
+import re
+
+
+@pytest.mark.parametrize('pattern, prefix', [
+    (r'\.join +(\#\#?[\w-]+)$', '.join'),
+    (r'\.scores(?: +(-?[0-9]+))?$', '.scores'),
+    (r'\.score +(\w+)', '.score'),
+    (r'abc?', 'ab'),
+    (r'ab{2}', 'a'),
+    (r'x\d', 'x'),
+    (r'a|b', ''),
+    (r'[|]a', ''),
+    (r'(?:a|b)c', ''),
+    (r'(?i)abc', ''),
+    (r'.abc', ''),
+])
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
+
+
+PATTERNS = [
+    r'\.score +(\w+)',
+    r'\.scores(?: +(-?[0-9]+))?$',
+    r'\.descore +(\w+)',
+    r'.*bacon',
+    r'\.s',
+    r'\.join +(\#\#?[\w-]+)$',
+]
+
+
+@pytest.mark.parametrize('text', [
+    ".score bacon",
+    ".scores",
+    ".scores 5",
+    ".scoresheet",
+    ".s",
+    ".descore bacon",
+    "I like bacon",
+    ".join #channel",
+    "just chatting",
+    "",
+])
+def test_matches_like_linear_search(text):
+    router = CommandRouter({pattern: pattern for pattern in PATTERNS})
+    expected = [
+        (match.group(0), pattern)
+        for pattern in PATTERNS
+        for match in [re.match(pattern, text)]
+        if match
+    ]
+    assert [
+        (match.group(0), pattern)
+        for match, pattern in router.match(text)
+    ] == expected
+
+
+def test_update_invalidates_index():
+    router = CommandRouter({r'\.a': 'a'})
+    assert [handler for _, handler in router.match(".b")] == []
+    router[r'\.b'] = 'b'
+    assert [handler for _, handler in router.match(".b")] == ['b']
+    del router[r'\.b']
+    assert [handler for _, handler in router.match(".b")] == []
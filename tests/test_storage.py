@@ -0,0 +1,56 @@
+from irc.storage import Storage
+import pytest
+import sqlite3
+
+
+SCHEMA = [
+    'CREATE TABLE item (name STRING)',
+    'CREATE INDEX item_name ON item (name)',
+]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path / "test.db"))
+    yield storage
+    storage.close()
+
+
+@pytest.mark.asyncio
+async def test_migrate(storage):
+    assert await storage.migrate('item', SCHEMA[:1]) == 1
+    await storage.execute('INSERT INTO item VALUES (?)', ("bacon",))
+    assert await storage.migrate('item', SCHEMA) == 2
+    assert await storage.migrate('item', SCHEMA) == 2
+    assert await storage.execute('SELECT name FROM item') == [("bacon",)]
+    indexes = await storage.execute(
+        "SELECT name FROM sqlite_master WHERE type='index'"
+    )
+    assert ("item_name",) in indexes
+
+
+@pytest.mark.asyncio
+async def test_migrate_independent_schemas(storage):
+    assert await storage.migrate('item', SCHEMA) == 2
+    assert await storage.migrate('other', ['CREATE TABLE other (x)']) == 1
+    assert await storage.migrate('item', SCHEMA) == 2
+
+
+@pytest.mark.asyncio
+async def test_migrate_failure_rolls_back(storage):
+    await storage.migrate('item', SCHEMA[:1])
+    with pytest.raises(sqlite3.OperationalError):
+        await storage.migrate('item', SCHEMA + ['NOT EVEN SQL'])
+    indexes = await storage.execute(
+        "SELECT name FROM sqlite_master WHERE type='index'"
+    )
+    assert ("item_name",) not in indexes
+    assert await storage.migrate('item', SCHEMA) == 2
+
+
+@pytest.mark.asyncio
+async def test_schema_version_column(storage):
+    await storage.migrate('item', SCHEMA)
+    columns = await storage.execute('PRAGMA table_info(schema_version)')
+    assert [(name, type) for _, name, type, *_ in columns] == \
+        [("name", "TEXT"), ("version", "INTEGER")]
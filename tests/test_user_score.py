@@ -0,0 +1,206 @@
+from irc.client import IRCClient
+from irc.message import IRCMessage
+from irc.plugins.user_score import (
+    ChannelScores, UserScore, find_score_change,
+)
+from tests.legacy_score import legacy_find_score_change
+import asyncio
+import pytest
+import random
+import sqlite3
+
+
+def test_channel_scores():
+    scores = ChannelScores([("bacon", 3), ("Nick", -1)])
+    assert scores.get("BACON") == 3
+    assert scores.get("nick") == -1
+    assert scores.get("other") is None
+    assert scores.change("NICK", 5) == 4
+    assert scores.top(1) == [("Nick", 4)]
+    assert scores.top(1, descending=False) == [("bacon", 3)]
+    scores.remove("Bacon")
+    assert scores.get("bacon") is None
+    assert scores.top(5) == [("Nick", 4)]
+    assert scores.top(0) == []
+
+
+def test_channel_scores_mirror_the_table():
+    rng = random.Random(0)
+    db = sqlite3.connect(':memory:')
+    for sql in UserScore.schema:
+        db.execute(sql)
+    scores = ChannelScores()
+    nicks = ["bacon", "Bacon", "nick", "NICK", "other", "x", "Y", "y"]
+    for _ in range(2000):
+        nick = rng.choice(nicks)
+        if rng.random() < 0.1:
+            scores.remove(nick)
+            db.execute(
+                'DELETE FROM score WHERE nick=? AND channel=?',
+                (nick, "#channel"),
+            )
+        else:
+            change = rng.choice((+1, -1))
+            scores.change(nick, change)
+            db.execute(
+                '''
+                INSERT INTO score (nick, channel, score) VALUES (?, ?, ?)
+                ON CONFLICT(nick, channel) DO UPDATE SET score = score + ?
+                ''',
+                (nick, "#channel", change, change),
+            )
+        for order in ('ASC', 'DESC'):
+            count = rng.randrange(10)
+            expected = db.execute(
+                f'''
+                SELECT nick, score FROM score
+                WHERE channel=?
+                ORDER BY score {order}
+                LIMIT ?
+                ''',
+                ("#channel", count),
+            ).fetchall()
+            assert scores.top(count, order == 'DESC') == expected
+        row = db.execute(
+            'SELECT score FROM score WHERE nick=? AND channel=?',
+            (nick, "#channel"),
+        ).fetchone()
+        assert scores.get(nick) == (row[0] if row else None)
+
+
+def compare_with_legacy(text, scorables):
+    folded = {scorable.lower() for scorable in scorables}
+    found = find_score_change(text, lambda name: name.lower() in folded)
+    # The regex took the first alternative matching, even if a longer
+    # one did too.  That depended on the order of the scorables and
+    # the nicks, find_score_change() prefers the longest one instead.
+    longest_first = sorted(scorables, key=len, reverse=True)
+    assert found == legacy_find_score_change(text, longest_first)
+    return found
+
+
+@pytest.mark.parametrize('text, found', [
+    ("bacon++", ("bacon", "++")),
+    ("++bacon", ("bacon", "++")),
+    ("I like BACON-- a lot", ("BACON", "--")),
+    ("nick: bacon++, alice--", ("bacon", "++")),
+    ("bacon+++", None),
+    ("baconalice++", None),
+    ("bacon++alice", None),
+    ("x++ alice++", ("alice", "++")),
+    ("(++alice)", ("alice", "++")),
+    ("alice-- bacon++", ("alice", "--")),
+    ("--alice bacon--", ("alice", "--")),
+    ("ice cream++", ("ice cream", "++")),
+    ("++ice cream", ("ice cream", "++")),
+    ("++ice creamy", ("ice", "++")),
+    ("a-b++", ("a-b", "++")),
+    ("b++", None),
+    ("No score changes here", None),
+])
+def test_find_score_change(text, found):
+    scorables = ["bacon", "alice", "ice", "ice cream", "a-b"]
+    assert compare_with_legacy(text, scorables) == found
+
+
+def test_find_score_change_random():
+    rng = random.Random(0)
+    pieces = ["a", "b", "A", " ", "+", "-", "++", "--", ".", "_", "a b"]
+    names = ["a", "b", "ab", "a b", "A_b", "b-a"]
+    for _ in range(5000):
+        text = "".join(
+            rng.choice(pieces) for _ in range(rng.randrange(1, 8))
+        )
+        compare_with_legacy(text, rng.sample(names, rng.randrange(1, 4)))
+
+
+@pytest.mark.asyncio
+async def test_migration_failure():
+    client = IRCClient(None, nick="Bot")
+    # Incompatible with the score_ranking index.
+    await client.db.execute('CREATE TABLE score (nick, channel)')
+    await client.load_plugins([
+        {'irc.plugins.user_score.UserScore': {
+            'admin': [],
+            'scorables': [],
+        }},
+    ])
+    assert 'UserScore' not in client.plugins
+    assert await client.db.execute('SELECT * FROM schema_version') == []
+    client.db.close()
+
+
+@pytest.mark.asyncio
+async def test_long_listing_does_not_block():
+    client = IRCClient(None, nick="Bot")
+    await client.load_plugins([
+        {'irc.plugins.user_score.UserScore': {
+            'admin': [],
+            'scorables': [],
+            'max_scoreboard_request': 50,
+        }},
+    ])
+    plugin = client.plugins['UserScore']
+    for i in range(40):
+        await client.db.execute(
+            'INSERT INTO score (nick, channel, score) VALUES (?, ?, ?)',
+            (f"nick{i}", "#channel", i),
+        )
+
+    def say(body):
+        return IRCMessage.parse(f":alice!a@host PRIVMSG #channel :{body}")
+
+    try:
+        # Nothing writes the messages out, as if the flood control
+        # held them back indefinitely.
+        await asyncio.wait_for(plugin.react(say(".scores 40")), 1)
+        await asyncio.wait_for(plugin.react(say(".score nick7")), 1)
+        sent = [
+            str(client.outgoing_queue.get_nowait()[0])
+            for _ in range(42)
+        ]
+        assert sent[0] == "PRIVMSG #channel :nick39's score is 39."
+        assert sent[40] == "PRIVMSG #channel :End of scores."
+        assert sent[41] == "PRIVMSG #channel :nick7's score is 7."
+    finally:
+        client.db.close()
+
+
+@pytest.mark.asyncio
+async def test_unknown_nicks():
+    client = IRCClient(None, nick="Bot")
+    await client.load_plugins([
+        {'irc.plugins.name_track.NameTrack': {'names_timeout': 0.2}},
+        {'irc.plugins.user_score.UserScore': {
+            'admin': [],
+            'scorables': ["bacon"],
+            'max_scoreboard_request': 10,
+        }},
+    ])
+    plugins = asyncio.ensure_future(asyncio.gather(
+        *(plugin.event_loop() for plugin in client.plugins.values())
+    ))
+
+    def say(body):
+        msg = IRCMessage.parse(f":alice!a@host PRIVMSG #channel :{body}")
+        for plugin in client.route(msg.command):
+            plugin.queue.put_nowait(msg)
+
+    async def sent():
+        msg, _ = await asyncio.wait_for(client.outgoing_queue.get(), 1)
+        return str(msg)
+
+    try:
+        # The NAMES queries are never answered.
+        say("bob++")
+        assert await sent() == "NAMES #channel"
+        await asyncio.sleep(0.3)
+        assert client.outgoing_queue.empty()
+        # The plugin is still running, and queries the nicks again.
+        say("bacon++")
+        assert await sent() == "NAMES #channel"
+        assert await sent() == "PRIVMSG #channel :bacon's score is now 1."
+        assert not plugins.done()
+    finally:
+        plugins.cancel()
+        client.db.close()